@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                                 "PyPaperBot")
+DEFAULT_TTL = 30 * 24 * 3600  # seconds
+DEFAULT_MAX_ENTRIES = 1000000
+
+
+class CrossrefCache:
+    """SQLite store of Crossref responses with a TTL and LRU eviction past max_entries."""
+
+    EVICT_EVERY = 500  # inserts between two eviction passes
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._closed = False  # lookups of threads still holding a replaced cache are misses
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL, "
+                           "last_access REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self._conn.commit()
+
+    # Returns (True, value) on a fresh hit and (False, None) otherwise
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return False, None
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] + self.ttl < now:
+                return False, None
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return True, json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+            self._conn.commit()
+            self._inserts += 1
+            if self._inserts % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access LIMIT ?)",
+                               (count - self.max_entries,))
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._conn.close()
+
+
+_crossref_cache = None
+_cache_dir = None
+
+
+# Replaces the cache in use, closing the previous one
+def configure(cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+    global _crossref_cache, _cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    previous = _crossref_cache
+    _cache_dir = cache_dir
+    _crossref_cache = CrossrefCache(os.path.join(cache_dir, "crossref.sqlite"), ttl, max_entries)
+    if previous is not None:
+        previous.close()
+    return _crossref_cache
+
+
+def disable():
+    global _crossref_cache, _cache_dir
+    previous = _crossref_cache
+    _crossref_cache = None
+    _cache_dir = None
+    if previous is not None:
+        previous.close()
+
+
+# Returns the configured Crossref cache, None if caching is disabled
+def getCrossrefCache():
+    return _crossref_cache
+
+
+# Returns the configured cache directory, None if caching is disabled
+def getCacheDir():
+    return _cache_dir
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from .Crossref import getPapersInfoFromDOIsBatch
+from .DOIList import uniqueDOIs
+from .Downloader import downloadPapers, setMirrors, saveMirrors, HostLimiter
+from .Library import Library
+from .Metrics import getMetrics
+from .Paper import BibtexStore, spillBibtex
+from .NetInfo import NetInfo
+from .PapersFilters import filterPapers
+from .Pipeline import Stage
+from .Reports import ReportWriter
+from .Scholar import iterScholarPapersInfo
+from . import Cache
+from . import HTTPClient
+from . import RateLimiter
+
+_DONE = object()
+
+
+class PaperBotClient:
+    """
+    Programmatic entry point for running many searches in one process. The client keeps the HTTP
+    session, the rate limiter, the Crossref cache, the Sci-Hub mirror pool, the per-host download
+    limits and the library open for its whole lifetime, so each batch only pays for its own requests.
+
+        with PaperBotClient("papers/", download_workers=8) as client:
+            for p in client.papers(DOIs=["10.1038/nature14539", "10.1145/3065386"]):
+                print(p.title, p.downloaded)
+
+    Network settings (rates, pool size, cache) are process-wide, as for the command line.
+    """
+
+    def __init__(self, dwn_dir, download=True, bibtex=True, min_year=None, journal_filter=None, SciHub_URL=None,
+                 SciDB_URL=None, chrome_version=None, use_doi_as_filename=False, download_workers=4, max_per_host=2,
+                 crossref_workers=4, scholar_workers=1, scholar_proxies=None, hedge_delay=None, library_dir=None,
+                 cache_dir=Cache.DEFAULT_CACHE_DIR, cache_ttl=Cache.DEFAULT_TTL, rate=None, min_rate=None,
+                 max_rate=None, report_formats=None, bibtex_on_disk=False, on_progress=None):
+        """
+        Input:
+            dwn_dir: directory of the downloaded PDFs (and of the report, if report_formats is given)
+            download: if False only the metadata is resolved
+            bibtex: if False the BibTeX of the papers is not fetched from Crossref
+            cache_dir: directory of the Crossref metadata cache, None to disable it
+            report_formats: if given, result.csv and bibtex.bib plus these REPORT_FORMATS are written in dwn_dir,
+                            in the order the papers are finished
+            bibtex_on_disk: if True the BibTeX entries of the papers of this client are kept in a temporary file of
+                            dwn_dir instead of memory. They can be read until the client is closed
+            on_progress: called as on_progress(paper, progress) with each finished paper, progress being a dict
+                         with the papers found, finished, downloaded and not downloaded so far
+            The other arguments are those of the command line
+        """
+        if SciDB_URL is not None and "/scidb" not in SciDB_URL:
+            SciDB_URL = urljoin(SciDB_URL, "/scidb/")
+
+        self.dwn_dir = dwn_dir
+        self.download = download
+        self.restrict = None if bibtex else 1
+        self.min_year = min_year
+        self.journal_filter = journal_filter
+        self.SciHub_URL = SciHub_URL
+        self.SciDB_URL = SciDB_URL
+        self.chrome_version = chrome_version
+        self.use_doi_as_filename = use_doi_as_filename
+        self.download_workers = download_workers
+        self.crossref_workers = crossref_workers
+        self.scholar_workers = scholar_workers
+        self.scholar_proxies = scholar_proxies
+        self.hedge_delay = hedge_delay
+        self.on_progress = on_progress
+        os.makedirs(dwn_dir, exist_ok=True)
+
+        if max_per_host > NetInfo.POOL_MAXSIZE:
+            NetInfo.POOL_MAXSIZE = max_per_host
+            HTTPClient.resetSession()
+        if rate is not None or min_rate is not None or max_rate is not None:
+            NetInfo.RATE = rate if rate is not None else NetInfo.RATE
+            NetInfo.MIN_RATE = min_rate if min_rate is not None else NetInfo.MIN_RATE
+            NetInfo.MAX_RATE = max_rate if max_rate is not None else NetInfo.MAX_RATE
+            RateLimiter.resetLimiter()
+        if cache_dir is None:
+            Cache.disable()
+        elif Cache.getCacheDir() != cache_dir:
+            Cache.configure(cache_dir, cache_ttl)
+
+        self.limiter = HostLimiter(max_per_host)
+        self.library = Library(library_dir) if library_dir is not None else None
+        self.report = ReportWriter(dwn_dir, report_formats) if report_formats is not None else None
+        self.bibtex_store = BibtexStore(dwn_dir) if bibtex_on_disk else None
+        self._mirrors = None
+        self._lock = threading.Lock()  # the report and the progress counters are shared by concurrent batches
+        self._progress = {"found": 0, "finished": 0, "downloaded": 0, "not downloaded": 0}
+
+    def mirrors(self):
+        with self._lock:
+            if self._mirrors is None:
+                self._mirrors = setMirrors(self.SciHub_URL, self.SciDB_URL)
+            return self._mirrors
+
+    def progress(self):
+        with self._lock:
+            return dict(self._progress)
+
+    # Timings and counters of the requests made so far, see Metrics
+    def metrics(self):
+        return getMetrics().summary()
+
+    def _found(self, papers):
+        for p in papers:
+            with self._lock:
+                self._progress["found"] += 1
+            yield p
+
+    def _finished(self, p):
+        with self._lock:
+            self._progress["finished"] += 1
+            if p.downloaded:
+                self._progress["downloaded"] += 1
+            elif self.download and p.canBeDownloaded():
+                self._progress["not downloaded"] += 1
+            if self.report is not None:
+                self.report.write(p)
+            progress = dict(self._progress)
+        if self.on_progress is not None:
+            self.on_progress(p, progress)
+
+    def _metadata(self, queries, DOIs, scholar_pages, scholar_results, cites, shard):
+        if DOIs is not None:
+            DOIs = uniqueDOIs(DOIs, shard, self.dwn_dir)
+            for p in getPapersInfoFromDOIsBatch(DOIs, self.restrict, max_workers=self.crossref_workers):
+                p.use_doi_as_filename = self.use_doi_as_filename
+                yield p
+        else:
+            pages = range(1, scholar_pages + 1) if isinstance(scholar_pages, int) else scholar_pages
+            for query in queries:
+                yield from iterScholarPapersInfo(query, pages, self.restrict, self.min_year, scholar_results,
+                                                 self.chrome_version, cites, workers=self.scholar_workers,
+                                                 proxies=self.scholar_proxies)
+
+    def papers(self, queries=None, DOIs=None, scholar_pages=1, scholar_results=10, cites=None, limit=None,
+               shard=None):
+        """
+        Input:
+            queries: Google Scholar query, or list of queries searched one after the other
+            DOIs: iterable of DOIs, resolved on Crossref by batches (used instead of queries). They are
+                  normalized and each one is resolved once, see DOIList.uniqueDOIs
+            scholar_pages: number of pages of each query, or iterable of page numbers
+            limit: maximum number of papers to download
+            shard: (i, N) to process only the i-th of N disjoint slices of DOIs
+        Output:
+            generator of the Paper objects, each one yielded as soon as it is finished (downloaded,
+            failed or not downloadable), so not in input order. Closing it early cancels the
+            downloads in flight and waits for them to stop
+        """
+        return self._papers(queries, DOIs, scholar_pages, scholar_results, cites, limit, shard, threading.Event())
+
+    # papers, stopped as soon as the stop event is set, which can be done from another thread
+    def _papers(self, queries, DOIs, scholar_pages, scholar_results, cites, limit, shard, stop):
+        if DOIs is None:
+            if queries is None and cites is None:
+                raise ValueError("provide queries, DOIs or cites")
+            queries = [queries] if queries is None or isinstance(queries, str) else queries
+
+        papers = self._found(self._metadata(queries, DOIs, scholar_pages, scholar_results, cites, shard))
+        if self.bibtex_store is not None:
+            papers = spillBibtex(papers, self.bibtex_store)
+        metadata = Stage(filterPapers(papers, self.journal_filter, self.min_year), closed=stop)
+        if not self.download:
+            try:
+                for p in metadata:
+                    self._finished(p)
+                    yield p
+            finally:
+                stop.set()
+            return
+
+        finished = queue.Queue()
+        error = []
+
+        def done(p):
+            self._finished(p)
+            finished.put(p)
+
+        def run():
+            try:
+                downloadPapers(metadata, self.dwn_dir, limit, self.SciHub_URL, self.SciDB_URL,
+                               self.download_workers, hedge_delay=self.hedge_delay, library=self.library,
+                               on_done=done, mirrors=self.mirrors(), limiter=self.limiter, stop=stop)
+            except BaseException as e:
+                error.append(e)
+            finally:
+                finished.put(_DONE)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                p = finished.get()
+                if p is _DONE:
+                    break
+                yield p
+        finally:
+            stop.set()  # also closes metadata
+            thread.join()
+        if error:
+            raise error[0]
+
+    async def apapers(self, queries=None, DOIs=None, scholar_pages=1, scholar_results=10, cites=None, limit=None,
+                      shard=None):
+        """Asynchronous variant of papers, the work is done in a thread so the event loop is never blocked"""
+        stop = threading.Event()
+        papers = self._papers(queries, DOIs, scholar_pages, scholar_results, cites, limit, shard, stop)
+        # A single thread drives the generator, so it is closed only once the next() in flight has returned
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            while True:
+                p = await asyncio.wrap_future(executor.submit(next, papers, _DONE))
+                if p is _DONE:
+                    return
+                yield p
+        finally:
+            stop.set()  # the next() in flight, if cancelled, returns at once
+            await asyncio.wrap_future(executor.submit(papers.close))
+            executor.shutdown(wait=False)
+
+    def close(self):
+        if self._mirrors is not None:
+            if self.SciHub_URL is None:
+                saveMirrors(self._mirrors)
+            NetInfo.SciHub_URL = self._mirrors.current()
+        if self.report is not None:
+            self.report.close()
+        if self.library is not None:
+            self.library.close()
+        if self.bibtex_store is not None:
+            self.bibtex_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
@@ -1,51 +1,262 @@
-from crossref_commons.iteration import iterate_publications_as_json
-from crossref_commons.retrieval import get_entity
-from crossref_commons.types import EntityType, OutputType
-from .PapersFilters import similarStrings
+import json
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from .TitleMatcher import TitleMatcher
 from .Paper import Paper
+from .NetInfo import NetInfo
+from . import HTTPClient
+from . import Cache
+from .Metrics import getMetrics
 import requests
-import time
-import random
+
+DOI_BATCH_SIZE = 50  # DOIs per filter=doi: request
+BIBTEX_WORKERS = 8  # BibTeX entries fetched concurrently
+BIBTEX_DEDUP_SIZE = 10000  # most recent DOIs whose BibTeX entry is reused by the later papers with the same DOI
+
+
+def cacheLookup(key):
+    cache = Cache.getCrossrefCache()
+    if cache is None:
+        return False, None
+    return cache.get(key)
+
+
+def cacheStore(key, value):
+    cache = Cache.getCrossrefCache()
+    if cache is not None:
+        cache.set(key, value)
+
+
+# Get the Crossref metadata of a single work
+def get_entity(DOI):
+    key = "work:" + DOI.lower()
+    found, paper = cacheLookup(key)
+    if not found:
+        r = HTTPClient.get(NetInfo.Crossref_URL + "/works/" + quote(DOI, safe=''), stage="crossref doi")
+        if r.status_code == 404:
+            paper = None
+        elif r.status_code != 200:
+            raise ConnectionError('API returned code {}'.format(r.status_code))
+        else:
+            paper = r.json().get("message")
+        cacheStore(key, paper)
+
+    if paper is None:
+        raise ValueError('DOI {} does not exist'.format(DOI))
+    return paper
+
+
+# Get the first max_results works matching the Crossref query parameters
+def iterate_publications_as_json(max_results, queries):
+    params = dict(queries)
+    params['rows'] = max_results
+    key = "query:" + json.dumps(params, sort_keys=True)
+    found, items = cacheLookup(key)
+    if not found:
+        r = HTTPClient.get(NetInfo.Crossref_URL + "/works", params=params, stage="crossref search")
+        if r.status_code != 200:
+            raise ConnectionError('API returned code {}'.format(r.status_code))
+        items = r.json()['message']['items']
+        cacheStore(key, items)
+    return items
 
 
 def getBibtex(DOI):
+    key = "bibtex:" + DOI.lower()
+    found, bibtex = cacheLookup(key)
+    if found:
+        return bibtex
+
     try:
-        url_bibtex = "http://api.crossref.org/works/" + DOI + "/transform/application/x-bibtex"
-        x = requests.get(url_bibtex)
+        url_bibtex = NetInfo.Crossref_URL + "/works/" + DOI + "/transform/application/x-bibtex"
+        x = HTTPClient.get(url_bibtex, stage="bibtex")
         if x.status_code == 404:
+            cacheStore(key, "")
             return ""
+        if x.status_code == 200:
+            cacheStore(key, str(x.text))
         return str(x.text)
     except Exception as e:
         print(e)
         return ""
 
 
-def getPapersInfoFromDOIs(DOI, restrict):
+def paperFromCrossref(DOI, paper):
     paper_found = Paper()
     paper_found.DOI = DOI
 
     try:
-        paper = get_entity(DOI, EntityType.PUBLICATION, OutputType.JSON)
-        if paper is not None and len(paper) > 0:
+        if paper is None:
+            raise ValueError('DOI {} does not exist'.format(DOI))
+        if len(paper) > 0:
             if "title" in paper:
                 paper_found.title = paper["title"][0]
             if "short-container-title" in paper and len(paper["short-container-title"]) > 0:
                 paper_found.jurnal = paper["short-container-title"][0]
-
-            if restrict is None or restrict != 1:
-                paper_found.setBibtex(getBibtex(paper_found.DOI))
     except:
         print("Paper not found " + DOI)
 
     return paper_found
 
 
-# Get paper information from Crossref and return a list of Paper
-def getPapersInfo(papers, scholar_search_link, restrict, scholar_results):
-    papers_return = []
+def lookupDOI(DOI):
+    try:
+        paper = get_entity(DOI)
+    except:
+        paper = None
+
+    return paperFromCrossref(DOI, paper)
+
+
+def getPapersInfoFromDOIs(DOI, restrict):
+    return next(iterBibtex([lookupDOI(DOI)], restrict))
+
+
+# True for the papers matched on Crossref, those of unknown DOIs have no title
+def isResolved(p):
+    return p.DOI is not None and p.title is not None
+
+
+"""
+Input
+    papers: iterable of Paper
+    restrict: as in getPapersInfoFromDOIs, if 1 no BibTeX is fetched
+    max_workers: number of BibTeX entries fetched concurrently
+Output
+    generator of the same papers in the same order, each one with the BibTeX entry of its DOI (papers
+    that already have one are left as they are). A DOI
+    shared by several papers is fetched once (among the last BIBTEX_DEDUP_SIZE DOIs, the older ones
+    are left to the Crossref cache). The entries are parsed only when year, authors or jurnal are read
+    (see Paper.parseBibtex)
+"""
+def iterBibtex(papers, restrict, max_workers=BIBTEX_WORKERS):
+    if restrict == 1:
+        yield from papers
+        return
+
+    pending = deque()  # (paper, future of its BibTeX or None), in input order
+    fetched = OrderedDict()  # DOI -> future, least recently used first
+
+    def settle():
+        p, future = pending.popleft()
+        if future is not None:
+            p.setBibtex(future.result())
+        return p
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for p in papers:
+            future = None
+            if isResolved(p) and p.bibtex is None:
+                key = p.DOI.lower()
+                future = fetched.get(key)
+                if future is None:
+                    future = fetched[key] = executor.submit(getBibtex, p.DOI)
+                    if len(fetched) > BIBTEX_DEDUP_SIZE:
+                        fetched.popitem(last=False)
+                else:
+                    fetched.move_to_end(key)
+            pending.append((p, future))
+
+            # The first papers are handed over as soon as their entry is there, the others wait in the window
+            while pending and (pending[0][1] is None or pending[0][1].done() or len(pending) > 2 * max_workers):
+                yield settle()
+        while pending:
+            yield settle()
+
+
+# Get the Crossref metadata of many works with a single filter=doi: request.
+# Returns a dict DOI -> metadata (None for the DOIs Crossref does not know)
+def get_entities(DOIs):
+    works = {}
+    missing = []
+    for DOI in DOIs:
+        found, paper = cacheLookup("work:" + DOI.lower())
+        if found:
+            works[DOI] = paper
+        else:
+            missing.append(DOI)
+
+    if len(missing) > 0:
+        params = {'filter': ",".join("doi:" + DOI for DOI in missing), 'rows': len(missing)}
+        r = HTTPClient.get(NetInfo.Crossref_URL + "/works", params=params, stage="crossref doi")
+        if r.status_code != 200:
+            raise ConnectionError('API returned code {}'.format(r.status_code))
+
+        items = {}
+        for el in r.json()['message']['items']:
+            if "DOI" in el:
+                items[el["DOI"].lower()] = el
+        for DOI in missing:
+            works[DOI] = items.get(DOI.lower())
+            cacheStore("work:" + DOI.lower(), works[DOI])
+
+    return works
+
+
+def resolveDOIBatch(DOIs):
+    # Commas would break the filter list, such DOIs are looked up one by one
+    batch = [DOI for DOI in DOIs if "," not in DOI]
+    t = time.time()
+    try:
+        works = get_entities(batch)
+    except Exception:
+        works = {}
+
+    papers = []
+    for DOI in DOIs:
+        if DOI in works:
+            papers.append(paperFromCrossref(DOI, works[DOI]))
+        else:
+            papers.append(lookupDOI(DOI))
+    getMetrics().addStage("crossref", time.time() - t)
+    return papers
+
+
+"""
+Input
+    DOIs: iterable of DOIs. Papers found among them (e.g. restored from a journal) are passed through
+    restrict: as in getPapersInfoFromDOIs
+    batch_size: number of DOIs resolved with a single Crossref request
+    max_workers: number of batches resolved concurrently
+Output
+    generator of Paper, in the same order as DOIs except for the papers passed through, which are handed
+    over as soon as they are read. The BibTeX entries are fetched by iterBibtex
+"""
+def getPapersInfoFromDOIsBatch(DOIs, restrict, batch_size=DOI_BATCH_SIZE, max_workers=4):
+    return iterBibtex(resolveDOIBatches(DOIs, batch_size, max_workers), restrict)
+
+
+def resolveDOIBatches(DOIs, batch_size, max_workers):
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batch = []
+        for DOI in DOIs:
+            if isinstance(DOI, Paper):
+                yield DOI
+                continue
+            batch.append(DOI)
+            if len(batch) == batch_size:
+                pending.append(executor.submit(resolveDOIBatch, batch))
+                batch = []
+            if len(pending) > max_workers:
+                yield from pending.popleft().result()
+        if len(batch) > 0:
+            pending.append(executor.submit(resolveDOIBatch, batch))
+        while pending:
+            yield from pending.popleft().result()
+
+
+# Get paper information from Crossref, yielding each Paper as soon as it is resolved
+def iterPapersInfo(papers, scholar_search_link, restrict):
+    return iterBibtex(searchPapers(papers, scholar_search_link), restrict)
+
+
+# Match each Scholar result with the most recently deposited Crossref work of the same title
+def searchPapers(papers, scholar_search_link):
     num = 1
     for paper in papers:
-        # while num <= scholar_results:
         title = paper['title']
         queries = {'query.bibliographic': title.lower(), 'sort': 'relevance',
                    "select": "DOI,title,deposited,author,short-container-title"}
@@ -54,8 +265,11 @@ def getPapersInfo(papers, scholar_search_link, restrict, scholar_results):
         num += 1
 
         found_timestamp = 0
+        matcher = TitleMatcher(title)
         paper_found = Paper(title, paper['link'], scholar_search_link, paper['cites'], paper['link_pdf'], paper['year'],
                             paper['authors'])
+        t = time.time()
+        attempts = 0
         while True:
             try:
                 for el in iterate_publications_as_json(max_results=30, queries=queries):
@@ -64,8 +278,8 @@ def getPapersInfo(papers, scholar_search_link, restrict, scholar_results):
                     if "deposited" in el and "timestamp" in el["deposited"]:
                         el_date = int(el["deposited"]["timestamp"])
 
-                    if (paper_found.DOI is None or el_date > found_timestamp) and "title" in el and similarStrings(
-                            title.lower(), el["title"][0].lower()) > 0.75:
+                    if (paper_found.DOI is None or el_date > found_timestamp) and "title" in el and matcher.matches(
+                            el["title"][0]):
                         found_timestamp = el_date
 
                         if "DOI" in el:
@@ -73,16 +287,19 @@ def getPapersInfo(papers, scholar_search_link, restrict, scholar_results):
                         if "short-container-title" in el and len(el["short-container-title"]) > 0:
                             paper_found.jurnal = el["short-container-title"][0]
 
-                        if restrict is None or restrict != 1:
-                            paper_found.setBibtex(getBibtex(paper_found.DOI))
-
                 break
-            except ConnectionError as e:
-                print("Wait 10 seconds and try again...")
-                time.sleep(10)
+            except (ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # HTTPClient has already slowed down Crossref, the limiter makes the next attempt wait
+                attempts += 1
+                if attempts > NetInfo.RETRIES:
+                    print("Crossref search failed, giving up: {}".format(e))
+                    break
+                print("Crossref search failed, trying again...")
+        getMetrics().addStage("crossref", time.time() - t)
 
-        papers_return.append(paper_found)
+        yield paper_found
 
-        time.sleep(random.randint(1, 10))
 
-    return papers_return
+# Get paper information from Crossref and return a list of Paper
+def getPapersInfo(papers, scholar_search_link, restrict, scholar_results):
+    return list(iterPapersInfo(papers, scholar_search_link, restrict))
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+from urllib.parse import unquote
+
+DEDUP_MEMORY_LIMIT = 1000000  # DOIs remembered in memory before the set of those already read moves to disk
+DEDUP_COMMIT_EVERY = 100000  # insertions between two commits of the on-disk set
+
+# Forms in which DOIs are found in exported lists, removed before the DOI is used
+URL_PREFIXES = ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi.org/",
+                "dx.doi.org/")
+DOI_PREFIXES = ("doi:",)
+
+
+# Returns the bare DOI of a line of a DOI list, None if it is not a DOI
+def normalizeDOI(DOI):
+    DOI = DOI.strip()
+    lower = DOI.lower()
+    for prefix in URL_PREFIXES:
+        if lower.startswith(prefix):
+            DOI = unquote(DOI[len(prefix):]).strip()
+            break
+    else:
+        for prefix in DOI_PREFIXES:
+            if lower.startswith(prefix):
+                DOI = DOI[len(prefix):].strip()
+                break
+
+    if not DOI.startswith("10.") or "/" not in DOI:
+        return None
+    return DOI
+
+
+# Stable across processes and machines, unlike hash(). DOIs are case insensitive
+def digestDOI(DOI):
+    return hashlib.blake2b(DOI.lower().encode("utf-8"), digest_size=16).digest()
+
+
+# Parses --shard i/N, i going from 1 to N
+def parseShard(shard):
+    i, n = [int(x) for x in shard.split("/")]
+    if not 1 <= i <= n:
+        raise ValueError("shard {} is not between 1 and {}".format(i, n))
+    return i, n
+
+
+def inShard(digest, shard):
+    if shard is None:
+        return True
+    i, n = shard
+    return int.from_bytes(digest[:8], "big") % n == i - 1
+
+
+class SeenSet:
+    """
+    Digests of the DOIs already read. Kept in memory up to max_memory entries, then moved to a
+    temporary SQLite file of directory so that lists of any size are deduplicated in bounded memory.
+    """
+
+    def __init__(self, directory=None, max_memory=DEDUP_MEMORY_LIMIT):
+        self.directory = directory
+        self.max_memory = max_memory
+        self._digests = set()
+        self._conn = None
+        self._path = None
+        self._added = 0
+
+    def _spill(self):
+        fd, self._path = tempfile.mkstemp(prefix="pypaperbot-dois-", suffix=".sqlite", dir=self.directory)
+        os.close(fd)
+        self._conn = sqlite3.connect(self._path)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.executemany("INSERT INTO seen VALUES (?)", ((d,) for d in self._digests))
+        self._conn.commit()
+        self._digests = set()
+
+    # Returns True if digest was not in the set
+    def add(self, digest):
+        if self._conn is None:
+            if digest in self._digests:
+                return False
+            self._digests.add(digest)
+            if len(self._digests) > self.max_memory:
+                self._spill()
+            return True
+
+        added = self._conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (digest,)).rowcount == 1
+        self._added += 1
+        if self._added % DEDUP_COMMIT_EVERY == 0:
+            self._conn.commit()
+        return added
+
+    def close(self):
+        self._digests = set()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            os.remove(self._path)
+
+
+"""
+Input
+    DOIs: iterable of DOIs, possibly as doi.org links or with a doi: prefix
+    shard: (i, N) to keep only the i-th of N disjoint slices of the DOIs, None to keep them all
+    spill_dir: directory of the on-disk set used by the deduplication of very long lists
+Output
+    generator of the bare DOIs, each one once (regardless of its case) in the order they are first found.
+    Lines that are not DOIs are skipped
+"""
+def uniqueDOIs(DOIs, shard=None, spill_dir=None):
+    seen = SeenSet(spill_dir)
+    read = duplicates = invalid = 0
+    try:
+        for line in DOIs:
+            DOI = normalizeDOI(line)
+            if DOI is None:
+                invalid += 1 if line.strip() else 0
+                continue
+            read += 1
+            digest = digestDOI(DOI)
+            if not inShard(digest, shard):
+                continue
+            if not seen.add(digest):
+                duplicates += 1
+                continue
+            yield DOI
+    finally:
+        seen.close()
+    if duplicates > 0 or invalid > 0:
+        print("{} DOIs read, {} duplicates and {} invalid lines skipped".format(read, duplicates, invalid))
+
+
+# Lines of a DOI list file, read as they are needed
+def readDOIFile(path):
+    with open(path, encoding="utf-8-sig", errors="replace") as file_in:
+        yield from file_in
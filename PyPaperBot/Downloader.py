@@ -1,107 +1,428 @@
 from os import path
-import requests
+import os
+import hashlib
+import threading
 import time
-from .HTMLparsers import getSchiHubPDF, SciHubUrls
-import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from .HTMLparsers import getSchiHubPDF
+from .Mirrors import discoverMirrors, saveMirrors, MirrorPool
 from .NetInfo import NetInfo
 from .Utils import URLjoin
+from .Library import linkFile, sameContent
+from .Metrics import getMetrics, SOURCES
+from . import HTTPClient
 
 
-def setSciHubUrl():
-    print("Searching for a sci-hub mirror")
-    r = requests.get(NetInfo.SciHub_URLs_repo, headers=NetInfo.HEADERS)
-    links = SciHubUrls(r.text)
+class HostLimiter:
+    """Caps the number of requests in flight towards the same host."""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[host]
+
+
+_save_lock = threading.Lock()
+_parts_lock = threading.Lock()
+_parts_in_use = set()
+CHUNK_SIZE = 64 * 1024
+
+
+class Cancelled(Exception):
+    pass
 
-    for l in links:
-        try:
-            print("Trying with {}...".format(l))
-            r = requests.get(l, headers=NetInfo.HEADERS)
-            if r.status_code == 200:
-                NetInfo.SciHub_URL = l
-                break
-        except:
-            pass
-    else:
-        print(
-            "\nNo working Sci-Hub instance found!\nIf in your country Sci-Hub is not available consider using a VPN or a proxy\nYou can use a specific mirror mirror with the --scihub-mirror argument")
-        NetInfo.SciHub_URL = "https://sci-hub.st"
 
+class LinkedEvent:
+    """Event that also reads as set once its parent event (if any) is set"""
 
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._parent = parent
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set() or (self._parent is not None and self._parent.is_set())
+
+
+_folder_names = {}  # folder -> names used in it, read once
+_name_copies = {}  # (folder, file name) -> last copy number used
+
+
+# Free file name for fname in folder, numbering copies as (2)fname, (3)fname... Must be called holding _save_lock
 def getSaveDir(folder, fname):
-    dir_ = path.join(folder, fname)
-    n = 1
-    while path.exists(dir_):
+    if folder not in _folder_names:
+        _folder_names[folder] = set(os.listdir(folder)) if path.isdir(folder) else set()
+    names = _folder_names[folder]
+
+    n = _name_copies.get((folder, fname), 1)
+    name = fname if n == 1 else f"({n}){fname}"
+    while name in names or path.exists(path.join(folder, name)):
         n += 1
-        dir_ = path.join(folder, f"({n}){fname}")
+        name = f"({n}){fname}"
+    _name_copies[(folder, fname)] = n
+    names.add(name)
+
+    return path.join(folder, name)
 
-    return dir_
 
+# Frees the name given by getSaveDir(folder, ...) to a file that could not be written. Must be called holding _save_lock
+def releaseSaveName(folder, file_name):
+    _folder_names.get(folder, set()).discard(path.basename(file_name))
 
-def saveFile(file_name, content, paper, dwn_source):
-    f = open(file_name, 'wb')
-    f.write(content)
-    f.close()
+
+def saveFile(file_name, part_file, paper, dwn_source):
+    os.replace(part_file, file_name)
 
     paper.downloaded = True
     paper.downloadedFrom = dwn_source
 
 
-def downloadPapers(papers, dwnl_dir, num_limit, SciHub_URL=None, SciDB_URL=None):
+def isPDF(content_type):
+    return content_type is not None and ('application/pdf' in content_type or "application/octet-stream" in content_type)
+
+
+# Partial downloads are keyed by URL so that only the same file is ever resumed
+def partialFile(dwnl_dir, url):
+    return path.join(dwnl_dir, "." + hashlib.sha1(url.encode()).hexdigest()[:16] + ".part")
+
+
+# Opens a streamed GET on url, asking only for the missing bytes if part_file holds a previous partial transfer.
+# Returns the response and the offset at which its body starts
+def openStream(url, part_file, stage=None, source=None):
+    offset = path.getsize(part_file) if path.exists(part_file) else 0
+    if offset == 0:
+        return HTTPClient.get(url, stream=True, stage=stage, source=source), 0
+
+    r = HTTPClient.get(url, headers={'Range': 'bytes={}-'.format(offset)}, stream=True, stage=stage, source=source)
+    if r.status_code == 206 and r.headers.get('content-range', '').startswith('bytes {}-'.format(offset)):
+        return r, offset
+
+    if r.status_code == 206 or r.status_code == 416:
+        r.close()
+        r = HTTPClient.get(url, stream=True, stage=stage, source=source)
+    return r, 0
+
+
+# Returns the number of bytes written
+def streamToFile(r, part_file, offset, cancel=None):
+    size = 0
+    with open(part_file, 'ab' if offset > 0 else 'wb') as f:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+# Downloads the PDF served at url (following the PDF link of a mirror landing page if landing_page is True)
+# into a partial file. Returns the partial file path on success, None otherwise.
+# Raises Cancelled as soon as the cancel event is set. source is the name of the download source for the metrics.
+# Unless keep_partial is False, an interrupted transfer is kept to be resumed by a later fetch of url
+def fetchPDF(url, dwnl_dir, limiter, landing_page, cancel=None, source=None, keep_partial=True):
+    stage = "landing page" if landing_page else "pdf"
+    part_file = partialFile(dwnl_dir, url)
+    with _parts_lock:
+        if part_file in _parts_in_use:
+            return None  # the same file is already being fetched for another source
+        _parts_in_use.add(part_file)
+
+    try:
+        with limiter.slot(url):
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            r, offset = openStream(url, part_file, stage, source)
+            with r:
+                if isPDF(r.headers.get('content-type')):
+                    t = time.time()
+                    size = streamToFile(r, part_file, offset, cancel)
+                    getMetrics().transfer(stage, url, source, size, time.time() - t)
+                    return part_file
+                if not landing_page:
+                    return None
+                # The link is extracted while the page streams in, the rest of the page is not read
+                r.encoding = r.encoding or 'utf-8'
+                pdf_link = getSchiHubPDF(r.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=True), url)
+    except BaseException:
+        if not keep_partial:
+            removePartial(part_file)
+        raise
+    finally:
+        with _parts_lock:
+            _parts_in_use.discard(part_file)
+
+    if pdf_link is None:
+        return None
+
+    return fetchPDF(pdf_link, dwnl_dir, limiter, False, cancel, source, keep_partial)
+
+
+# Sources to try for a paper, in fallback order: SciDB, SciHub by DOI, SciHub by Scholar link, Scholar PDFs
+def downloadSources(p, scihub_url):
+    sources = []  # (dwn_source, url) with dwn_source 1 scidb - 2 scihub - 3 scholar
+    if p.DOI is not None:
+        sources.append((1, URLjoin(NetInfo.SciDB_URL, p.DOI)))
+        sources.append((2, URLjoin(scihub_url, p.DOI)))
+    if p.scholar_link is not None:
+        sources.append((2, URLjoin(scihub_url, p.scholar_link)))
+    if p.scholar_link is not None and p.scholar_link[-3:] == "pdf":
+        sources.append((3, p.scholar_link))
+    if p.pdf_link is not None:
+        sources.append((3, p.pdf_link))
+    return sources
+
+
+# Moves a completed partial file to its final name (through the library if any) and returns that name
+def storePDF(p, dwnl_dir, part_file, dwn_source, library=None):
+    if library is not None:
+        return linkPDF(p, dwnl_dir, library.add(part_file, p.DOI, dwn_source), dwn_source)
+
+    with _save_lock:
+        file_name = getSaveDir(dwnl_dir, p.getFileName())
+        try:
+            saveFile(file_name, part_file, p, dwn_source)
+        except OSError:
+            releaseSaveName(dwnl_dir, file_name)
+            raise
+    return path.basename(file_name)
+
+
+# storePDF for a fetched PDF, returns None if it cannot be saved (e.g. a name too long for the file system)
+# after deleting the partial file, so that only this paper fails
+def tryStorePDF(p, dwnl_dir, part_file, dwn_source, library=None):
+    try:
+        return storePDF(p, dwnl_dir, part_file, dwn_source, library)
+    except OSError as e:
+        print("Cannot save the PDF of {}: {}".format(p.title, e))
+        removePartial(part_file)
+        return None
 
-    NetInfo.SciHub_URL = SciHub_URL
-    if NetInfo.SciHub_URL is None:
-        setSciHubUrl()
+
+def removePartial(part_file):
+    try:
+        os.remove(part_file)
+    except OSError:
+        pass
+
+
+# Links a PDF of the library into dwnl_dir, reusing the file already there if it holds the same bytes
+def linkPDF(p, dwnl_dir, object_path, dwn_source):
+    existing = path.join(dwnl_dir, p.getFileName())
+    with _save_lock:
+        if path.exists(existing) and sameContent(existing, object_path):
+            file_name = existing
+        else:
+            file_name = getSaveDir(dwnl_dir, p.getFileName())
+            try:
+                linkFile(object_path, file_name)
+            except OSError:
+                releaseSaveName(dwnl_dir, file_name)
+                raise
+
+    p.downloaded = True
+    p.downloadedFrom = dwn_source
+    return path.basename(file_name)
+
+
+# Tries the sources of a paper one after another, returns the saved file name or None (also when stop is set)
+def downloadPaper(p, dwnl_dir, limiter, mirrors, library=None, stop=None):
+    scihub_url = mirrors.current()
+    for dwn_source, url in downloadSources(p, scihub_url):
+        part_file = None
+        try:
+            part_file = fetchPDF(url, dwnl_dir, limiter, dwn_source == 1 or dwn_source == 2, stop, SOURCES[dwn_source])
+        except Cancelled:
+            return None
+        except Exception:
+            pass
+
+        if dwn_source == 2:
+            mirrors.record(scihub_url, part_file is not None)
+        if part_file is not None:
+            return tryStorePDF(p, dwnl_dir, part_file, dwn_source, library)
+
+    return None
+
+
+# Hedged variant of downloadPaper: the next source is started whenever the running ones have not
+# produced a PDF within hedge_delay seconds (at once if 0). The first PDF wins and the other fetches are cancelled,
+# their partial files are deleted
+def downloadPaperHedged(p, dwnl_dir, limiter, mirrors, hedge_delay, library=None, stop=None):
+    scihub_url = mirrors.current()
+    sources = downloadSources(p, scihub_url)
+    cancel = LinkedEvent(stop)
+    executor = ThreadPoolExecutor(max_workers=max(len(sources), 1))
+    pending = {}
+    winner = None
+    next_source = 0
+    try:
+        while winner is None and (next_source < len(sources) or pending):
+            if next_source < len(sources):
+                dwn_source, url = sources[next_source]
+                future = executor.submit(fetchPDF, url, dwnl_dir, limiter, dwn_source == 1 or dwn_source == 2, cancel,
+                                         SOURCES[dwn_source], False)
+                pending[future] = dwn_source
+                next_source += 1
+
+            timeout = hedge_delay if next_source < len(sources) else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                dwn_source = pending.pop(future)
+                try:
+                    part_file = future.result()
+                except Cancelled:
+                    continue
+                except Exception:
+                    part_file = None
+
+                if dwn_source == 2:
+                    mirrors.record(scihub_url, part_file is not None)
+                if part_file is not None and winner is None:
+                    winner = (dwn_source, part_file)
+                elif part_file is not None:
+                    removePartial(part_file)
+    finally:
+        cancel.set()
+        # Fetches still running delete their file when cancelled, those completing meanwhile are deleted here
+        winner_file = winner[1] if winner is not None else None
+        for future in pending:
+            future.add_done_callback(lambda f: discardPartial(f, winner_file))
+        executor.shutdown(wait=False)
+
+    if winner is None:
+        return None
+
+    dwn_source, part_file = winner
+    return tryStorePDF(p, dwnl_dir, part_file, dwn_source, library)
+
+
+# Deletes the partial file fetched by future, unless it is keep
+def discardPartial(future, keep):
+    try:
+        part_file = future.result()
+    except BaseException:
+        return
+    if part_file is not None and part_file != keep:
+        removePartial(part_file)
+
+
+def downloadJob(p, dwnl_dir, limiter, mirrors, hedge_delay, journal, library, stop=None):
+    metrics = getMetrics()
+    with metrics.timed("download"):
+        file_name = None
+        download = True
+        # A PDF held by the library that cannot be linked fails the paper, one that cannot be looked up is downloaded
+        try:
+            held = library.lookup(p.DOI) if library is not None else None
+            if held is not None:
+                download = False
+                file_name = linkPDF(p, dwnl_dir, held[0], held[1])
+        except OSError as e:
+            print("Cannot use the library for {}: {}".format(p.title, e))
+        if download and hedge_delay is None:
+            file_name = downloadPaper(p, dwnl_dir, limiter, mirrors, library, stop)
+        elif download:
+            file_name = downloadPaperHedged(p, dwnl_dir, limiter, mirrors, hedge_delay, library, stop)
+    if stop is not None and stop.is_set() and file_name is None:
+        return False  # abandoned, neither counted nor journaled as a failure
+    metrics.count("papers downloaded" if file_name is not None else "downloads failed")
+
+    if journal is not None:
+        if file_name is not None:
+            journal.downloaded(p, file_name)
+        else:
+            journal.downloadFailed(p)
+    return file_name is not None
+
+
+def setMirrors(SciHub_URL, SciDB_URL):
+    if SciHub_URL is None:
+        mirrors = discoverMirrors()
+    else:
+        mirrors = MirrorPool([SciHub_URL])
+    NetInfo.SciHub_URL = mirrors.current()
     if SciDB_URL is not None:
         NetInfo.SciDB_URL = SciDB_URL
 
     print("\nUsing Sci-Hub mirror {}".format(NetInfo.SciHub_URL))
     print("Using Sci-DB mirror {}".format(NetInfo.SciDB_URL))
     print("You can use --scidb-mirror and --scidb-mirror to specify your're desired mirror URL\n")
+    return mirrors
+
 
+# on_done, if given, is called with each paper once it is finished: downloaded, failed or skipped.
+# mirrors and limiter can be shared by several calls, otherwise they are set up for this one.
+# Once the stop event (if any) is set, no paper is started, the transfers in flight are cancelled and
+# the papers they were for are not passed to on_done
+def downloadPapers(papers, dwnl_dir, num_limit, SciHub_URL=None, SciDB_URL=None, max_workers=1, max_per_host=2,
+                   hedge_delay=None, journal=None, library=None, on_done=None, mirrors=None, limiter=None, stop=None):
+
+    own_mirrors = mirrors is None  # if so, set up with the first paper to download
+    limiter = limiter if limiter is not None else HostLimiter(max_per_host)
+    total = len(papers) if hasattr(papers, '__len__') else "?"
     num_downloaded = 0
     paper_number = 1
-    paper_files = []
-    for p in papers:
-        if p.canBeDownloaded() and (num_limit is None or num_downloaded < num_limit):
-            print("Download {} of {} -> {}".format(paper_number, len(papers), p.title))
-            paper_number += 1
+    pending = set()
+    jobs = {}  # future -> paper
 
-            pdf_dir = getSaveDir(dwnl_dir, p.getFileName())
+    def finished(done):
+        n = 0
+        for f in done:
+            p = jobs.pop(f)
+            if f.result():
+                n += 1
+            if on_done is not None and not (stop is not None and stop.is_set() and not p.downloaded):
+                on_done(p)
+        return n
 
-            failed = 0
-            url = ""
-            while not p.downloaded and failed != 5:
-                try:
-                    dwn_source = 1  # 1 scidb - 2 scihub - 3 scholar
-                    if failed == 0 and p.DOI is not None:
-                        url = URLjoin(NetInfo.SciDB_URL, p.DOI)
-                    if failed == 1 and p.DOI is not None:
-                        url = URLjoin(NetInfo.SciHub_URL, p.DOI)
-                        dwn_source = 2
-                    if failed == 2 and p.scholar_link is not None:
-                        url = URLjoin(NetInfo.SciHub_URL, p.scholar_link)
-                    if failed == 3 and p.scholar_link is not None and p.scholar_link[-3:] == "pdf":
-                        url = p.scholar_link
-                        dwn_source = 3
-                    if failed == 4 and p.pdf_link is not None:
-                        url = p.pdf_link
-                        dwn_source = 3
-
-                    if url != "":
-                        r = requests.get(url, headers=NetInfo.HEADERS)
-                        content_type = r.headers.get('content-type')
-
-                        if (dwn_source == 1 or dwn_source == 2) and 'application/pdf' not in content_type and "application/octet-stream" not in content_type:
-                            time.sleep(random.randint(1, 4))
-
-                            pdf_link = getSchiHubPDF(r.text)
-                            if pdf_link is not None:
-                                r = requests.get(pdf_link, headers=NetInfo.HEADERS)
-                                content_type = r.headers.get('content-type')
-
-                        if 'application/pdf' in content_type or "application/octet-stream" in content_type:
-                            paper_files.append(saveFile(pdf_dir, r.content, p, dwn_source))
-                except Exception:
-                    pass
+    # Papers are submitted in order and never more than num_limit - num_downloaded are in flight,
+    # so the limit is honored exactly and earlier papers in the (sorted) list are preferred.
+    # papers can also be an iterator fed by the metadata stages, downloads start with its first item
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for p in papers:
+            if stop is not None and stop.is_set():
+                break
+            if p.downloaded or not p.canBeDownloaded():
+                if p.downloaded:
+                    num_downloaded += 1  # restored from the journal of a previous run
+                if on_done is not None:
+                    on_done(p)
+                continue
+
+            while pending and (len(pending) >= max_workers or
+                               (num_limit is not None and num_downloaded + len(pending) >= num_limit)):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                num_downloaded += finished(done)
+
+            if num_limit is not None and num_downloaded >= num_limit:
+                if on_done is not None:
+                    on_done(p)
+                continue  # keep consuming papers, a streamed input is still being resolved for the report
+
+            if mirrors is None:
+                mirrors = setMirrors(SciHub_URL, SciDB_URL)
+
+            print("Download {} of {} -> {}".format(paper_number, total, p.title))
+            paper_number += 1
+            future = executor.submit(downloadJob, p, dwnl_dir, limiter, mirrors, hedge_delay, journal, library, stop)
+            jobs[future] = p
+            pending.add(future)
+
+        done, pending = wait(pending)
+        num_downloaded += finished(done)
 
-                failed += 1
+    if own_mirrors and mirrors is not None:
+        if SciHub_URL is None:
+            saveMirrors(mirrors)
+        NetInfo.SciHub_URL = mirrors.current()
+    return num_downloaded
@@ -4,60 +4,116 @@ Created on Sun Jun  7 11:59:42 2020
 
 @author: Vito
 """
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from html.parser import HTMLParser
+from urllib.parse import urlparse
 import re
 
+# Parser backends BeautifulSoup can build the tree with, "auto" uses lxml when it is installed
+PARSER_BACKENDS = ("auto", "lxml", "html.parser")
+
+_parser = None
+
+
+def setParserBackend(name="auto"):
+    global _parser
+    if name not in PARSER_BACKENDS:
+        raise ValueError("Unknown HTML parser backend: {}".format(name))
+    if name == "auto":
+        try:
+            import lxml  # noqa: F401
+            name = "lxml"
+        except ImportError:
+            name = "html.parser"
+    elif name == "lxml":
+        import lxml  # noqa: F401
+    _parser = name
+    return name
+
+
+def getParserBackend():
+    if _parser is None:
+        setParserBackend()
+    return _parser
+
+
+# Builds the soup with the current backend, only keeping the tags matched by parse_only if given
+def makeSoup(html, parse_only=None):
+    return BeautifulSoup(html, getParserBackend(), parse_only=parse_only)
+
+
+SCHOLAR_RESULT = SoupStrainer("div", class_="gs_r gs_or gs_scl")
+SCIHUB_MIRRORS = SoupStrainer("ul")
+
+
+def hasClass(tag, name):
+    return name in (tag.get("class") or ())
+
 
 def schoolarParser(html):
     result = []
-    soup = BeautifulSoup(html, "html.parser")
-    for element in soup.findAll("div", class_="gs_r gs_or gs_scl"):
-        if not isBook(element):
-            title = None
-            link = None
-            link_pdf = None
-            cites = None
-            year = None
-            authors = None
-            for h3 in element.findAll("h3", class_="gs_rt"):
-                found = False
-                for a in h3.findAll("a"):
-                    if not found:
+    soup = makeSoup(html, SCHOLAR_RESULT)
+    for element in soup.find_all("div", class_="gs_r gs_or gs_scl"):
+        title = None
+        link = None
+        link_pdf = None
+        cites = None
+        year = None
+        authors = None
+        book = False
+        cited_by = []
+        gs_a = []
+        # Single pass over the tags of the result instead of one findAll per field
+        for tag in element.find_all(["h3", "a", "div", "span"]):
+            if tag.name == "a":
+                text = tag.text
+                if "Cited by" in text:
+                    cited_by.append(text)
+                if "[PDF]" in text:
+                    link_pdf = tag.get("href")
+            elif tag.name == "h3":
+                if hasClass(tag, "gs_rt"):
+                    a = tag.find("a")
+                    if a is not None:
                         title = a.text
                         link = a.get("href")
-                        found = True
-            for a in element.findAll("a"):
-                if "Cited by" in a.text:
-                    cites = int(a.text[8:])
-                if "[PDF]" in a.text:
-                    link_pdf = a.get("href")
-            for div in element.findAll("div", class_="gs_a"):
-                try:
-                    authors, source_and_year, source = div.text.replace('\u00A0', ' ').split(" - ")
-                except ValueError:
-                    continue
-
-                if not authors.strip().endswith('\u2026'):
-                    # There is no ellipsis at the end so we know the full list of authors
-                    authors = authors.replace(', ', ';')
-                else:
-                    authors = None
-                try:
-                    year = int(source_and_year[-4:])
-                except ValueError:
-                    continue
-                if not (1000 <= year <= 3000):
-                    year = None
-                else:
-                    year = str(year)
-            if title is not None:
-                result.append({
-                    'title': title,
-                    'link': link,
-                    'cites': cites,
-                    'link_pdf': link_pdf,
-                    'year': year,
-                    'authors': authors})
+            elif tag.name == "div":
+                if hasClass(tag, "gs_a"):
+                    gs_a.append(tag)
+            elif hasClass(tag, "gs_ct2") and tag.text == "[B]":
+                book = True
+        if book:
+            continue
+
+        for text in cited_by:
+            cites = int(text[8:])
+        for div in gs_a:
+            try:
+                authors, source_and_year, source = div.text.replace('\u00A0', ' ').split(" - ")
+            except ValueError:
+                continue
+
+            if not authors.strip().endswith('\u2026'):
+                # There is no ellipsis at the end so we know the full list of authors
+                authors = authors.replace(', ', ';')
+            else:
+                authors = None
+            try:
+                year = int(source_and_year[-4:])
+            except ValueError:
+                continue
+            if not (1000 <= year <= 3000):
+                year = None
+            else:
+                year = str(year)
+        if title is not None:
+            result.append({
+                'title': title,
+                'link': link,
+                'cites': cites,
+                'link_pdf': link_pdf,
+                'year': year,
+                'authors': authors})
     return result
 
 
@@ -69,36 +125,206 @@ def isBook(tag):
     return result
 
 
-def getSchiHubPDF(html):
-    result = None
-    soup = BeautifulSoup(html, "html.parser")
+class PDFLinkRule:
+    """
+    Rule of the PDF link extractor: the first tag matching tag and attrs gives the link in its
+    link_attr attribute. attrs values are strings or compiled regular expressions searched in the
+    attribute value, text is a function of the tag string like the string argument of
+    BeautifulSoup.find. If add_scheme is True links not starting with "h" get "https:" in front.
+    """
 
-    iframe = soup.find(id='pdf') #scihub logic
-    plugin = soup.find(id='plugin') #scihub logic
-    download_scidb = soup.find("a", text=lambda text: text and "Download" in text, href=re.compile(r"\.pdf$")) #scidb logic
-    embed_scihub = soup.find("embed") #scihub logic
+    def __init__(self, tag=None, attrs=None, link_attr="src", text=None, add_scheme=False):
+        self.tag = tag
+        self.attrs = attrs if attrs is not None else {}
+        self.link_attr = link_attr
+        self.text = text
+        self.add_scheme = add_scheme
 
-    if iframe is not None:
-        result = iframe.get("src")
+    def matchesTag(self, tag, attrs):
+        if self.tag is not None and tag != self.tag:
+            return False
+        for name, expected in self.attrs.items():
+            value = attrs.get(name)
+            if value is None:
+                return False
+            if isinstance(expected, str):
+                if value != expected and not (name == "class" and expected in value.split()):
+                    return False
+            elif expected.search(value) is None:
+                return False
+        return True
 
-    if plugin is not None and result is None:
-        result = plugin.get("src")
+    def link(self, attrs):
+        link = attrs.get(self.link_attr)
+        if link is not None and self.add_scheme and not link.startswith("h"):
+            link = "https:" + link
+        return link
 
-    if result is not None and result[0] != "h":
-        result = "https:" + result
 
-    if download_scidb is not None and result is None:
-        result = download_scidb.get("href")
+# Generic rules, by priority: SciHub iframe and plugin, SciDB download link, SciHub embed
+PDF_RULES = [
+    PDFLinkRule(attrs={"id": "pdf"}, add_scheme=True),
+    PDFLinkRule(attrs={"id": "plugin"}, add_scheme=True),
+    PDFLinkRule("a", {"href": re.compile(r"\.pdf$")}, "href", text=lambda text: text and "Download" in text),
+    PDFLinkRule("embed", link_attr="original-url"),
+]
 
-    if embed_scihub is not None and result is None:
-        result = embed_scihub.get("original-url")
+_mirror_rules = {}
 
-    return result
+
+# Adds a rule to the extractor. Rules of a mirror (host name) are tried before the generic ones on its pages,
+# generic rules are tried after the existing ones
+def registerPDFRule(rule, mirror=None):
+    if mirror is None:
+        PDF_RULES.append(rule)
+    else:
+        _mirror_rules.setdefault(mirror.lower(), []).append(rule)
+
+
+def pdfRules(url=None):
+    host = urlparse(url).hostname if url else None
+    return _mirror_rules.get(host, []) + PDF_RULES if host else PDF_RULES
+
+
+# Tags without content, closed as soon as they are opened
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+             "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+             "nextid", "spacer"}
+
+
+class LinkFound(Exception):
+    pass
+
+
+class TextCapture:
+    """Content of a tag matched by a rule on its text, kept until the tag is closed"""
+
+    def __init__(self, index, tag, attrs):
+        self.index = index
+        self.tag = tag
+        self.attrs = attrs
+        self.open_tags = []
+        self.nodes = []  # ("start", tag), ("end", tag), ("data", text)
+
+    # The equivalent of Tag.string: the only child string, or the string of the only child tag
+    def string(self):
+        nodes = []
+        for node in self.nodes:
+            if node[0] == "data" and nodes and nodes[-1][0] == "data":
+                nodes[-1] = ("data", nodes[-1][1] + node[1])
+            else:
+                nodes.append(node)
+        while True:
+            if len(nodes) == 1 and nodes[0][0] == "data":
+                return nodes[0][1]
+            if len(nodes) < 2 or nodes[0][0] != "start":
+                return None
+            depth = 0
+            for i, node in enumerate(nodes):
+                depth += 1 if node[0] == "start" else -1 if node[0] == "end" else 0
+                if depth == 0:
+                    break
+            if i != len(nodes) - 1:
+                return None
+            nodes = nodes[1:-1]
+
+
+class PDFLinkParser(HTMLParser):
+    """
+    Single streaming pass over a mirror landing page applying all the rules at once. The first tag
+    matching each rule settles it, parsing stops (LinkFound) as soon as a rule gives a link and all the
+    rules before it are settled without one.
+    """
+
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = rules
+        self.settled = [False] * len(rules)
+        self.links = [None] * len(rules)
+        self.captures = []
+
+    def settle(self, index, link):
+        if self.settled[index]:
+            return
+        self.settled[index] = True
+        self.links[index] = link
+        for rule_settled, rule_link in zip(self.settled, self.links):
+            if not rule_settled:
+                return
+            if rule_link is not None:
+                raise LinkFound()
+        raise LinkFound()  # every rule settled without a link
+
+    def link(self):
+        for link in self.links:
+            if link is not None:
+                return link
+        return None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value if value is not None else "" for name, value in attrs}
+        for capture in self.captures:
+            capture.nodes.append(("start", tag))
+            capture.open_tags.append(tag)
+        for i, rule in enumerate(self.rules):
+            if not self.settled[i] and rule.matchesTag(tag, attrs):
+                if rule.text is None:
+                    self.settle(i, rule.link(attrs))
+                elif tag not in VOID_TAGS:
+                    self.captures.append(TextCapture(i, tag, attrs))
+                elif rule.text(None):
+                    self.settle(i, rule.link(attrs))
+        if tag in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        for capture in list(self.captures):
+            if tag in capture.open_tags:
+                while capture.open_tags:
+                    capture.nodes.append(("end", capture.open_tags[-1]))
+                    if capture.open_tags.pop() == tag:
+                        break
+            elif tag == capture.tag:
+                self.closeCapture(capture)
+
+    def handle_data(self, data):
+        for capture in self.captures:
+            capture.nodes.append(("data", data))
+
+    def closeCapture(self, capture):
+        self.captures.remove(capture)
+        while capture.open_tags:
+            capture.nodes.append(("end", capture.open_tags.pop()))
+        rule = self.rules[capture.index]
+        if rule.text(capture.string()):
+            self.settle(capture.index, rule.link(capture.attrs))
+
+    def close(self):
+        super().close()
+        for capture in list(self.captures):
+            self.closeCapture(capture)
+
+
+# Returns the PDF link of a mirror landing page given as a string or as an iterable of text chunks, url being
+# the address of the page to apply the rules of its mirror
+def extractPDFLink(html, url=None):
+    parser = PDFLinkParser(pdfRules(url))
+    try:
+        for chunk in [html] if isinstance(html, str) else html:
+            parser.feed(chunk)
+        parser.close()
+    except LinkFound:
+        pass
+    return parser.link()
+
+
+def getSchiHubPDF(html, url=None):
+    return extractPDFLink(html, url)
 
 
 def SciHubUrls(html):
     result = []
-    soup = BeautifulSoup(html, "html.parser")
+    soup = makeSoup(html, SCIHUB_MIRRORS)
 
     for ul in soup.findAll("ul"):
         for a in ul.findAll("a"):
@@ -0,0 +1,67 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from .NetInfo import NetInfo
+from .RateLimiter import getLimiter
+from .Metrics import getMetrics
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Returns the process-wide session, keeping pooled keep-alive connections per host
+def getSession():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=NetInfo.POOL_CONNECTIONS, pool_maxsize=NetInfo.POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(NetInfo.HEADERS)
+                _session = session
+    return _session
+
+
+# Drops the current session so that the next request picks up the NetInfo pool settings again
+def resetSession():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+# GET through the shared session, paced by the per-host rate limiter. Requests answered with
+# 429 or 503 are retried up to max_retries (default NetInfo.RETRIES) times once the host pause is over.
+# The request is accounted in the run metrics under stage and source (see Metrics)
+def get(url, retries=None, stage=None, source=None, **kwargs):
+    kwargs.setdefault('timeout', NetInfo.TIMEOUT)
+    max_retries = NetInfo.RETRIES if retries is None else retries
+    limiter = getLimiter()
+    metrics = getMetrics()
+    retries = 0
+    waited = 0.0  # time in the rate limiter, not counted in the request latency
+    t = time.time()
+    while True:
+        w = time.time()
+        limiter.acquire(url)
+        waited += time.time() - w
+        metrics.wait(url, time.time() - w)
+        try:
+            r = getSession().get(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            limiter.penalize(url)
+            metrics.request(stage, url, source, time.time() - t - waited, None, retries)
+            raise
+
+        limiter.feedback(url, r.status_code, r.headers)
+        if (r.status_code == 429 or r.status_code == 503) and retries < max_retries:
+            retries += 1
+            r.close()
+            continue
+        size = 0 if kwargs.get('stream') else len(r.content)
+        metrics.request(stage, url, source, time.time() - t - waited, r.status_code, retries, size)
+        return r
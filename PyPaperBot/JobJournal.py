@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+from .Paper import Paper
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+# Identifies a paper across runs
+def paperKey(p):
+    if p.DOI is not None:
+        return "doi:" + p.DOI.lower()
+    if p.scholar_link is not None:
+        return "link:" + p.scholar_link
+    return "title:" + str(p.title)
+
+
+# Options a journal can only be resumed with: papers and pages of another query must not be restored
+def runHeader(query=None, cites=None, min_date=None, scholar_results=None, doi_source=None):
+    return {"query": query, "cites": cites, "min_date": min_date, "scholar_results": scholar_results,
+            "doi_source": doi_source}
+
+
+class JournalState:
+    def __init__(self):
+        self.header = None  # runHeader of the run that wrote the journal, None for journals written before it
+        self.dois = {}  # input DOI -> Paper
+        self.pages = {}  # Scholar page -> list of Paper
+        self.downloads = {}  # paper key -> (file name, download source)
+        self.failed = set()  # paper keys whose download failed
+
+
+class JobJournal:
+    """
+    Append-only JSON lines journal of a run, written in dwn_dir as papers are resolved and
+    downloaded. Every line is flushed when written, so a crashed or interrupted run can be
+    resumed from it with load(). The first line records the runHeader of the run.
+    """
+
+    def __init__(self, dwn_dir, resume=False, header=None):
+        self.path = os.path.join(dwn_dir, JOURNAL_FILE)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        if header is not None and self._file.tell() == 0:
+            self._write({"event": "run", "header": header})
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def doiResolved(self, DOI, paper):
+        self._write({"event": "doi", "doi": DOI, "paper": paper.toDict()})
+
+    def pageResolved(self, page, papers):
+        self._write({"event": "page", "page": page, "papers": [p.toDict() for p in papers]})
+
+    def downloaded(self, paper, file_name):
+        self._write({"event": "downloaded", "key": paperKey(paper), "file": file_name,
+                     "source": paper.downloadedFrom})
+
+    def downloadFailed(self, paper):
+        self._write({"event": "failed", "key": paperKey(paper)})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Reads the journal in dwn_dir; a line truncated by a crash is ignored
+def loadJournal(dwn_dir):
+    state = JournalState()
+    path = os.path.join(dwn_dir, JOURNAL_FILE)
+    if not os.path.exists(path):
+        return state
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            event = record.get("event")
+            if event == "run":
+                if state.header is None:
+                    state.header = record["header"]
+            elif event == "doi":
+                state.dois[record["doi"]] = Paper.fromDict(record["paper"])
+            elif event == "page":
+                state.pages[record["page"]] = [Paper.fromDict(p) for p in record["papers"]]
+            elif event == "downloaded":
+                state.downloads[record["key"]] = (record["file"], record["source"])
+                state.failed.discard(record["key"])
+            elif event == "failed":
+                state.failed.add(record["key"])
+    return state
+
+
+# Marks as downloaded the papers the journal recorded as saved in dwn_dir, if their file is still there
+def restoreDownloads(papers, state, dwn_dir):
+    restored = 0
+    for p in papers:
+        key = paperKey(p)
+        if key in state.downloads:
+            file_name, source = state.downloads[key]
+            if os.path.exists(os.path.join(dwn_dir, file_name)):
+                p.downloaded = True
+                p.downloadedFrom = source
+                restored += 1
+    return restored
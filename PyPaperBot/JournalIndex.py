@@ -0,0 +1,143 @@
+import csv
+import hashlib
+import os
+import pickle
+from collections import Counter
+from difflib import SequenceMatcher
+import numpy as np
+
+INDEX_VERSION = 2
+SIMILARITY = 0.8  # minimum similarStrings ratio for a journal to match
+EPS = 1e-9
+
+_loaded = {}
+
+
+def normalize(name):
+    return " ".join(name.casefold().split())
+
+
+class JournalIndex:
+    """
+    Index of the journals included by a journal filter csv, answering whether a journal
+    name has a similarStrings ratio >= 0.8 with any of them.
+
+    Lookups try a raw exact match, then the journals with the same normalized name, then a
+    shortlist built from character counts. Since ratio = 2M / (len(a) + len(b)) and the M
+    matched characters are common to both strings, 2 * sum(min(count_a(c), count_b(c))) /
+    (len(a) + len(b)) (difflib's quick_ratio) is an upper bound of the ratio. The bound is
+    computed at once for all journals of compatible length, and only the journals that can
+    reach the threshold go through the full SequenceMatcher ratio, so the result is the
+    same as comparing against every row.
+    """
+
+    def __init__(self, journals):
+        self.journals = sorted(dict.fromkeys(journals), key=len)
+        self.exact = set(self.journals)
+        self.normalized = {}
+        for i, jurnal in enumerate(self.journals):
+            self.normalized.setdefault(normalize(jurnal), []).append(i)
+
+        self.alphabet = {}
+        for jurnal in self.journals:
+            for c in jurnal:
+                self.alphabet.setdefault(c, len(self.alphabet))
+
+        self.lengths = np.array([len(jurnal) for jurnal in self.journals], dtype=np.int64)
+        self.counts = np.zeros((len(self.journals), max(len(self.alphabet), 1)), dtype=np.uint16)
+        for i, jurnal in enumerate(self.journals):
+            for c, n in Counter(jurnal).items():
+                self.counts[i, self.alphabet[c]] = min(n, 65535)
+
+    # Indexes of the journals whose quick_ratio with name reaches the threshold, best bound first
+    def candidates(self, name):
+        la = len(name)
+        # ratio <= 2 * min(la, lb) / (la + lb), so lb must be within [2/3 la, 3/2 la]
+        lo = int(np.searchsorted(self.lengths, 2 * la / 3 - EPS, side="left"))
+        hi = int(np.searchsorted(self.lengths, 1.5 * la + EPS, side="right"))
+        if lo >= hi:
+            return []
+
+        query = np.zeros(self.counts.shape[1], dtype=np.uint16)
+        for c, n in Counter(name).items():
+            if c in self.alphabet:
+                query[self.alphabet[c]] = min(n, 65535)
+
+        shared = np.minimum(self.counts[lo:hi], query).sum(axis=1, dtype=np.int64)
+        bound = 2.0 * shared / (la + self.lengths[lo:hi])
+        selected = np.nonzero(bound >= SIMILARITY - EPS)[0]
+        return [lo + int(i) for i in selected[np.argsort(-bound[selected], kind="stable")]]
+
+    def matches(self, name):
+        if name in self.exact:
+            return True
+        if len(self.journals) == 0 or len(name) == 0:
+            return False
+
+        checked = set()
+        for i in self.normalized.get(normalize(name), ()):
+            checked.add(i)
+            if SequenceMatcher(None, name, self.journals[i]).ratio() >= SIMILARITY:
+                return True
+
+        for i in self.candidates(name):
+            if i not in checked and SequenceMatcher(None, name, self.journals[i]).ratio() >= SIMILARITY:
+                return True
+        return False
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((INDEX_VERSION, self), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+
+def readJournals(csv_path):
+    journals = []
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            jurnal = row.get("journal_list")
+            try:
+                include = float(row.get("include_list")) == 1
+            except (TypeError, ValueError):
+                include = False
+            if include and jurnal:
+                journals.append(jurnal)
+    return journals
+
+
+"""
+Input
+    csv_path: path of the journal filter csv
+    cache_dir: directory in which the built index is stored, None to keep it in memory only
+Output
+    JournalIndex of the journals included by the csv, rebuilt only when the csv changes
+"""
+def loadJournalIndex(csv_path, cache_dir=None):
+    stat = os.stat(csv_path)
+    key = "{}:{}:{}".format(os.path.abspath(csv_path), stat.st_mtime_ns, stat.st_size)
+    if key in _loaded:
+        return _loaded[key]
+
+    index = None
+    index_file = None
+    if cache_dir is not None:
+        index_file = os.path.join(cache_dir, "journals-" + hashlib.sha1(key.encode()).hexdigest()[:16] + ".pickle")
+        try:
+            with open(index_file, "rb") as f:
+                version, index = pickle.load(f)
+            if version != INDEX_VERSION:
+                index = None
+        except Exception:
+            index = None
+
+    if index is None:
+        index = JournalIndex(readJournals(csv_path))
+        if index_file is not None:
+            try:
+                index.save(index_file)
+            except OSError:
+                pass
+
+    _loaded[key] = index
+    return index
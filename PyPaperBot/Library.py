@@ -0,0 +1,94 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+OBJECT_MODE = 0o444  # stored objects are read-only, so a PDF edited in place through a hardlink fails instead of corrupting them
+
+
+def fileHash(file_name):
+    h = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Hardlinks src to dst, copying it when hardlinks are not possible (e.g. across file systems). The copy is writable
+def linkFile(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+# True if file_name holds the bytes of the stored object, whether it is a hardlink or a copy of it
+def sameContent(file_name, object_path):
+    if os.path.samefile(file_name, object_path):
+        return True
+    if os.path.getsize(file_name) != os.path.getsize(object_path):
+        return False
+    return fileHash(file_name) == os.path.splitext(os.path.basename(object_path))[0]
+
+
+def protectObject(object_path):
+    if os.stat(object_path).st_mode & 0o222:
+        os.chmod(object_path, OBJECT_MODE)
+
+
+class Library:
+    """
+    Content-addressed store of every PDF downloaded with the same library root. Files are kept
+    once per SHA-256 under root/objects and indexed by DOI in root/library.sqlite, so papers
+    already held are linked into new output directories without any request and identical
+    bytes fetched from different sources are stored only once. Objects are made read-only since
+    the PDFs of the output directories are hardlinks to them.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "library.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (sha256 TEXT PRIMARY KEY, size INTEGER)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dois (doi TEXT PRIMARY KEY, sha256 TEXT, source INTEGER)")
+        self._conn.commit()
+
+    def objectPath(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256 + ".pdf")
+
+    # Returns (object path, download source) of the PDF held for DOI, None if there is none
+    def lookup(self, DOI):
+        if DOI is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT sha256, source FROM dois WHERE doi = ?", (DOI.lower(),)).fetchone()
+        if row is None or not os.path.exists(self.objectPath(row[0])):
+            return None
+        protectObject(self.objectPath(row[0]))  # objects stored before they were made read-only
+        return self.objectPath(row[0]), row[1]
+
+    # Moves a downloaded file into the store (dropping it if the same bytes are already there)
+    # and returns the path of the stored object
+    def add(self, file_name, DOI, source):
+        sha256 = fileHash(file_name)
+        object_path = self.objectPath(sha256)
+        with self._lock:
+            if os.path.exists(object_path):
+                os.remove(file_name)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(file_name, object_path)
+            protectObject(object_path)
+            self._conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?)", (sha256, os.path.getsize(object_path)))
+            if DOI is not None:
+                self._conn.execute("INSERT OR REPLACE INTO dois VALUES (?, ?, ?)", (DOI.lower(), sha256, source))
+            self._conn.commit()
+        return object_path
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,223 @@
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_FILE = "metrics.json"
+PROMETHEUS_FILE = "metrics.prom"
+
+# Download source names, by dwn_source
+SOURCES = {1: "SciDB", 2: "SciHub", 3: "Scholar"}
+
+
+def hostOf(url):
+    return urlparse(url).netloc if url else ""
+
+
+class Series:
+    """Requests of one (stage, host, source) key"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.retries = 0
+        self.failures = 0
+        self.transfer_seconds = 0.0
+
+    def toDict(self):
+        return {"requests": self.count, "seconds": self.seconds, "bytes": self.bytes, "retries": self.retries,
+                "failures": self.failures, "transfer_seconds": self.transfer_seconds,
+                "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.buckets))}
+
+
+class Metrics:
+    """
+    Timings and counters of a run: latency histogram, bytes, retries and failures of the outbound
+    requests by stage, host and download source, time spent waiting on the rate limiter by host,
+    wall time of the timed stages and event counters (papers found, downloaded...).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._series = {}
+        self._waits = {}
+        self._stages = {}
+        self._events = {}
+
+    def _get(self, stage, url, source):
+        key = (stage or "other", hostOf(url), source or "")
+        if key not in self._series:
+            self._series[key] = Series()
+        return self._series[key]
+
+    # One outbound request (with its retries): seconds until the answer, its status or None if it failed to connect
+    def request(self, stage, url, source, seconds, status=None, retries=0, size=0):
+        with self._lock:
+            s = self._get(stage, url, source)
+            s.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            s.count += 1
+            s.seconds += seconds
+            s.bytes += size
+            s.retries += retries
+            if status is None or status >= 400:
+                s.failures += 1
+
+    # Body of a streamed request read after the answer
+    def transfer(self, stage, url, source, size, seconds):
+        with self._lock:
+            s = self._get(stage, url, source)
+            s.bytes += size
+            s.transfer_seconds += seconds
+
+    def wait(self, url, seconds):
+        with self._lock:
+            host = hostOf(url)
+            self._waits[host] = self._waits.get(host, 0.0) + seconds
+
+    def count(self, event, n=1):
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + n
+
+    def addStage(self, stage, seconds):
+        with self._lock:
+            total, count = self._stages.get(stage, (0.0, 0))
+            self._stages[stage] = (total + seconds, count + 1)
+
+    @contextmanager
+    def timed(self, stage):
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.addStage(stage, time.time() - t)
+
+    def summary(self):
+        with self._lock:
+            series = [dict(stage=k[0], host=k[1], source=k[2], **s.toDict()) for k, s in sorted(self._series.items())]
+            summary = {
+                "elapsed": time.time() - self.started,
+                "events": dict(self._events),
+                "rate_limit_waits": dict(self._waits),
+                "stages": {stage: {"seconds": total, "count": count} for stage, (total, count) in self._stages.items()},
+                "requests": series,
+            }
+        for group in ("stage", "host", "source"):
+            totals = {}
+            for s in series:
+                t = totals.setdefault(s[group], {"requests": 0, "seconds": 0.0, "bytes": 0, "retries": 0,
+                                                 "failures": 0})
+                for field in t:
+                    t[field] += s[field]
+            summary["by_" + group] = totals
+        return summary
+
+    def prometheus(self):
+        summary = self.summary()
+        lines = ["# HELP pypaperbot_request_seconds Latency of the outbound requests",
+                 "# TYPE pypaperbot_request_seconds histogram"]
+        for s in summary["requests"]:
+            labels = 'stage="{}",host="{}",source="{}"'.format(s["stage"], s["host"], s["source"])
+            cumulative = 0
+            for le, n in s["buckets"].items():
+                cumulative += n
+                lines.append('pypaperbot_request_seconds_bucket{{{},le="{}"}} {}'.format(labels, le, cumulative))
+            lines.append("pypaperbot_request_seconds_sum{{{}}} {}".format(labels, s["seconds"]))
+            lines.append("pypaperbot_request_seconds_count{{{}}} {}".format(labels, s["requests"]))
+        for name, field, help in (("response_bytes", "bytes", "Bytes received"),
+                                  ("retries", "retries", "Requests retried after 429 or 503"),
+                                  ("failures", "failures", "Requests failed or answered with an error")):
+            lines.append("# HELP pypaperbot_{}_total {}".format(name, help))
+            lines.append("# TYPE pypaperbot_{}_total counter".format(name))
+            for s in summary["requests"]:
+                lines.append('pypaperbot_{}_total{{stage="{}",host="{}",source="{}"}} {}'.format(
+                    name, s["stage"], s["host"], s["source"], s[field]))
+        lines += ["# HELP pypaperbot_rate_limit_wait_seconds_total Time spent waiting on the rate limiter",
+                  "# TYPE pypaperbot_rate_limit_wait_seconds_total counter"]
+        for host, seconds in summary["rate_limit_waits"].items():
+            lines.append('pypaperbot_rate_limit_wait_seconds_total{{host="{}"}} {}'.format(host, seconds))
+        lines += ["# HELP pypaperbot_stage_seconds_total Wall time of the timed stages",
+                  "# TYPE pypaperbot_stage_seconds_total counter"]
+        for stage, s in summary["stages"].items():
+            lines.append('pypaperbot_stage_seconds_total{{stage="{}"}} {}'.format(stage, s["seconds"]))
+        lines += ["# HELP pypaperbot_events_total Papers found, downloaded and failed",
+                  "# TYPE pypaperbot_events_total counter"]
+        for event, n in summary["events"].items():
+            lines.append('pypaperbot_events_total{{event="{}"}} {}'.format(event, n))
+        return "\n".join(lines) + "\n"
+
+    # Writes metrics.json and the Prometheus textfile metrics.prom in dwn_dir
+    def write(self, dwn_dir):
+        for file_name, content in ((METRICS_FILE, json.dumps(self.summary(), indent=2)),
+                                   (PROMETHEUS_FILE, self.prometheus())):
+            file_path = os.path.join(dwn_dir, file_name)
+            with open(file_path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(file_path + ".tmp", file_path)
+
+    def progressLine(self):
+        summary = self.summary()
+        events = summary["events"]
+        return "[{:.0f}s] papers: {} found, {} downloaded, {} failed | {:.1f} MB | requests: {}, retries: {}, " \
+               "failures: {} | rate limit waits: {:.0f}s".format(
+                   summary["elapsed"], events.get("papers found", 0), events.get("papers downloaded", 0),
+                   events.get("downloads failed", 0),
+                   sum(s["bytes"] for s in summary["requests"]) / 2 ** 20,
+                   sum(s["requests"] for s in summary["requests"]),
+                   sum(s["retries"] for s in summary["requests"]),
+                   sum(s["failures"] for s in summary["requests"]), sum(summary["rate_limit_waits"].values()))
+
+
+class Reporter:
+    """
+    Background thread refreshing the metrics files of dwn_dir every interval seconds, and printing
+    the progress line every second if progress is True
+    """
+
+    def __init__(self, metrics, dwn_dir, progress=False, interval=10):
+        self.metrics = metrics
+        self.dwn_dir = dwn_dir
+        self.progress = progress
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        ticks = 0
+        while not self._stop.wait(1):
+            ticks += 1
+            if self.progress:
+                sys.stderr.write("\r" + self.metrics.progressLine())
+                sys.stderr.flush()
+            if ticks % self.interval == 0:
+                self.metrics.write(self.dwn_dir)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.metrics.write(self.dwn_dir)
+        if self.progress:
+            sys.stderr.write("\r" + self.metrics.progressLine() + "\n")
+
+
+_metrics = Metrics()
+
+
+def getMetrics():
+    return _metrics
+
+
+# Starts a new run from zeroed metrics
+def resetMetrics():
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .HTMLparsers import SciHubUrls
+from .NetInfo import NetInfo
+from . import HTTPClient
+from .Cache import getCacheDir
+
+MIRRORS_FILE = "scihub_mirrors.json"
+
+
+# Time in seconds to get the response headers of url, None if it is not reachable or answers with an error
+def probeMirror(url, timeout):
+    start = time.monotonic()
+    try:
+        r = HTTPClient.get(url, timeout=timeout, stream=True, retries=0, stage="mirror probe")
+        r.close()
+    except Exception:
+        return None
+    if r.status_code != 200:
+        return None
+    return time.monotonic() - start
+
+
+# Probes all the mirrors at once and returns the reachable ones sorted by latency
+def rankMirrors(links, timeout=NetInfo.PROBE_TIMEOUT):
+    if len(links) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(links), 16)) as executor:
+        latencies = list(executor.map(lambda l: probeMirror(l, timeout), links))
+    ranked = [(latency, l) for l, latency in zip(links, latencies) if latency is not None]
+    ranked.sort()
+    return [l for latency, l in ranked]
+
+
+class MirrorPool:
+    """
+    Ranked Sci-Hub mirrors. Download outcomes are recorded per mirror, and the mirror in use
+    is moved to the back of the ranking when its success rate over the last window attempts
+    drops below min_success_rate.
+    """
+
+    def __init__(self, mirrors, window=20, min_success_rate=0.1):
+        self.mirrors = list(mirrors)
+        self.window = window
+        self.min_success_rate = min_success_rate
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            return self.mirrors[0]
+
+    def record(self, mirror, success):
+        with self._lock:
+            outcomes = self.outcomes.setdefault(mirror, deque(maxlen=self.window))
+            outcomes.append(success)
+            if (len(self.mirrors) > 1 and self.mirrors[0] == mirror and len(outcomes) == self.window and
+                    sum(outcomes) / len(outcomes) < self.min_success_rate):
+                self.mirrors.append(self.mirrors.pop(0))
+                outcomes.clear()
+                print("Sci-Hub mirror {} is failing, switching to {}".format(mirror, self.mirrors[0]))
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with self._lock:
+            with open(tmp, "w") as f:
+                json.dump({"timestamp": time.time(), "mirrors": self.mirrors}, f)
+        os.replace(tmp, path)
+
+
+def loadMirrors(path, ttl):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data["timestamp"] + ttl >= time.time() and len(data["mirrors"]) > 0:
+            return data["mirrors"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def mirrorsFile():
+    cache_dir = getCacheDir()
+    return os.path.join(cache_dir, MIRRORS_FILE) if cache_dir is not None else None
+
+
+# Returns a MirrorPool with the Sci-Hub mirrors ranked by latency, reusing the last ranking if still valid
+def discoverMirrors():
+    path = mirrorsFile()
+    if path is not None:
+        mirrors = loadMirrors(path, NetInfo.MIRRORS_TTL)
+        if mirrors is not None:
+            return MirrorPool(mirrors)
+
+    print("Searching for a sci-hub mirror")
+    try:
+        r = HTTPClient.get(NetInfo.SciHub_URLs_repo, stage="mirror list")
+        links = SciHubUrls(r.text)
+    except Exception:
+        links = []
+
+    mirrors = rankMirrors(links)
+    if len(mirrors) == 0:
+        print(
+            "\nNo working Sci-Hub instance found!\nIf in your country Sci-Hub is not available consider using a VPN or a proxy\nYou can use a specific mirror mirror with the --scihub-mirror argument")
+        return MirrorPool(["https://sci-hub.st"])
+
+    pool = MirrorPool(mirrors)
+    if path is not None:
+        try:
+            pool.save(path)
+        except OSError:
+            pass
+    return pool
+
+
+def saveMirrors(pool):
+    path = mirrorsFile()
+    if path is not None:
+        try:
+            pool.save(path)
+        except OSError:
+            pass
@@ -1,5 +1,22 @@
 class NetInfo:
     SciHub_URL = None
     SciDB_URL = "https://annas-archive.se/scidb/"
+    Scholar_URL = "https://scholar.google.com/scholar"
+    Crossref_URL = "https://api.crossref.org"
     HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36'}
-    SciHub_URLs_repo = "https://sci-hub.41610.org/"
\ No newline at end of file
+    SciHub_URLs_repo = "https://sci-hub.41610.org/"
+
+    # Shared HTTP client settings (see HTTPClient)
+    POOL_CONNECTIONS = 16  # number of hosts to keep a connection pool for
+    POOL_MAXSIZE = 16  # keep-alive connections kept per host
+    TIMEOUT = (10, 60)  # connect and read timeout in seconds
+
+    # Per-host rate limits in requests per second (see RateLimiter)
+    RATE = 1.0  # starting rate
+    MIN_RATE = 0.1
+    MAX_RATE = 5.0
+    RETRIES = 3  # retries of a request answered with 429 or 503
+
+    # Sci-Hub mirror discovery (see Mirrors)
+    PROBE_TIMEOUT = (3, 5)  # connect and first byte timeout of a mirror probe
+    MIRRORS_TTL = 24 * 3600  # seconds a mirror ranking is reused before probing again
@@ -4,16 +4,79 @@ Created on Mon Jun  8 21:43:30 2020
 
 @author: Vito
 """
-import bibtexparser
 import re
-import pandas as pd
+import sys
+import tempfile
+import threading
 import urllib.parse
+from .Reports import CSVReportWriter, BibtexWriter
+
+# Attributes of a paper, as persisted by toDict
+FIELDS = ("title", "scholar_page", "scholar_link", "pdf_link", "year", "authors", "jurnal", "cites_num", "bibtex", "DOI",
+          "downloaded", "downloadedFrom", "use_doi_as_filename")
+
+SPILL_LENGTH_BITS = 20  # a spilled entry is referenced by offset << SPILL_LENGTH_BITS | length, longer ones stay in memory
+
+
+class BibtexStore:
+    """
+    Append-only temporary file holding the BibTeX entries of the papers of a run, so that a run over
+    millions of papers keeps only an integer per entry in memory. The file is deleted when closed, the
+    entries of its papers can no longer be read after that.
+    """
+
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(prefix="pypaperbot-bibtex-", dir=directory)
+        self.size = 0
+        self._lock = threading.Lock()
+
+    # Returns the reference of the stored entry, None if it is too long to be referenced
+    def put(self, bibtex):
+        data = bibtex.encode("utf-8")
+        if len(data) >= 1 << SPILL_LENGTH_BITS:
+            return None
+        with self._lock:
+            self.file.seek(self.size)
+            self.file.write(data)
+            offset = self.size
+            self.size += len(data)
+        return offset << SPILL_LENGTH_BITS | len(data)
+
+    def get(self, ref):
+        with self._lock:
+            self.file.seek(ref >> SPILL_LENGTH_BITS)
+            return self.file.read(ref & ((1 << SPILL_LENGTH_BITS) - 1)).decode("utf-8")
+
+    def close(self):
+        self.file.close()
+
+
+# Passes the papers through, moving their BibTeX entries (and those set later) to store
+def spillBibtex(papers, store):
+    for p in papers:
+        p.spillBibtex(store)
+        yield p
+
+
+def intern(value):
+    return sys.intern(value) if type(value) is str else value
 
 
 class Paper:
+    """
+    Slotted record: journal names and years are interned as many papers share them, BibTeX entries can be
+    kept on disk (see spillBibtex)
+    """
 
+    __slots__ = ("title", "scholar_page", "scholar_link", "pdf_link", "_year", "_authors", "_jurnal", "cites_num",
+                 "_bibtex", "_bibtex_pending", "_bibtex_store", "DOI", "downloaded", "downloadedFrom",
+                 "use_doi_as_filename")
 
     def __init__(self,title=None, scholar_link=None, scholar_page=None, cites=None, link_pdf=None, year=None, authors=None):        
+        self._bibtex = None
+        self._bibtex_store = None  # BibtexStore of the entry, see spillBibtex
+        self._bibtex_pending = False  # set by setBibtex, the entry is parsed when year, authors or jurnal is read
+
         self.title = title
         self.scholar_page = scholar_page
         self.scholar_link = scholar_link
@@ -23,7 +86,6 @@ class Paper:
 
         self.jurnal = None
         self.cites_num = None
-        self.bibtex = None
         self.DOI = None
 
         self.downloaded = False
@@ -40,76 +102,103 @@ class Paper:
             except:
                 return "none.pdf"
 
-    def setBibtex(self, bibtex):
-        x = bibtexparser.loads(bibtex, parser=None)
-        x = x.entries
+    @property
+    def bibtex(self):
+        if type(self._bibtex) is int:
+            return self._bibtex_store.get(self._bibtex)
+        return self._bibtex
+
+    @bibtex.setter
+    def bibtex(self, bibtex):
+        ref = None
+        if self._bibtex_store is not None and bibtex:
+            ref = self._bibtex_store.put(bibtex)
+        self._bibtex = ref if ref is not None else bibtex
+
+    # Moves the BibTeX entry to store, as well as the entries set from now on
+    def spillBibtex(self, store):
+        bibtex = self.bibtex
+        self._bibtex_store = store
+        self.bibtex = bibtex
 
+    def setBibtex(self, bibtex):
         self.bibtex = bibtex
+        self._bibtex_pending = True
 
+    # Year, authors and journal (or publisher) of the BibTeX entry given to setBibtex replace the previous ones
+    def parseBibtex(self):
+        if not self._bibtex_pending:
+            return
+
+        # The flag is cleared once the fields are set: a paper read by another thread meanwhile is parsed twice
         try:
+            import bibtexparser  # imported with the first BibTeX entry read
+            x = bibtexparser.loads(self.bibtex, parser=None)
+            x = x.entries
+
             if "year" in x[0]:
-                self.year = x[0]["year"]
+                self._year = intern(x[0]["year"])
             if 'author' in x[0]:
-                self.authors = x[0]["author"]
-            self.jurnal = x[0]["journal"].replace("\\", "") if "journal" in x[0] else None
-            if self.jurnal is None:
-                self.jurnal = x[0]["publisher"].replace("\\", "") if "publisher" in x[0] else None
+                self._authors = x[0]["author"]
+            self._jurnal = intern(x[0]["journal"].replace("\\", "")) if "journal" in x[0] else None
+            if self._jurnal is None:
+                self._jurnal = intern(x[0]["publisher"].replace("\\", "")) if "publisher" in x[0] else None
         except:
             pass
+        self._bibtex_pending = False
+
+    @property
+    def year(self):
+        self.parseBibtex()
+        return self._year
+
+    @year.setter
+    def year(self, year):
+        self.parseBibtex()
+        self._year = intern(year)
+
+    @property
+    def authors(self):
+        self.parseBibtex()
+        return self._authors
+
+    @authors.setter
+    def authors(self, authors):
+        self.parseBibtex()
+        self._authors = authors
+
+    @property
+    def jurnal(self):
+        self.parseBibtex()
+        return self._jurnal
+
+    @jurnal.setter
+    def jurnal(self, jurnal):
+        self.parseBibtex()
+        self._jurnal = intern(jurnal)
+
+    # Plain dict of the paper attributes, used to persist it (see JobJournal)
+    def toDict(self):
+        return {k: getattr(self, k) for k in FIELDS}
+
+    def fromDict(d):
+        p = Paper()
+        for k, v in d.items():
+            if k in FIELDS:
+                setattr(p, k, v)
+        return p
 
     def canBeDownloaded(self):
         return self.DOI is not None or self.scholar_link is not None
 
     def generateReport(papers, path):
-        # Define the column names
-        columns = ["Name", "Scholar Link", "DOI", "Bibtex", "PDF Name",
-                   "Year", "Scholar page", "Journal", "Downloaded",
-                   "Downloaded from", "Authors"]
-
-        # Prepare data to populate the DataFrame
-        data = []
+        writer = CSVReportWriter(path)
         for p in papers:
-            pdf_name = p.getFileName() if p.downloaded else ""
-            bibtex_found = p.bibtex is not None
-
-            # Determine download source
-            dwn_from = ""
-            if p.downloadedFrom == 1:
-                dwn_from = "SciDB"
-            elif p.downloadedFrom == 2:
-                dwn_from = "SciHub"
-            elif p.downloadedFrom == 3:
-                dwn_from = "Scholar"
-
-            # Append row data as a dictionary
-            data.append({
-                "Name": p.title,
-                "Scholar Link": p.scholar_link,
-                "DOI": p.DOI,
-                "Bibtex": bibtex_found,
-                "PDF Name": pdf_name,
-                "Year": p.year,
-                "Scholar page": p.scholar_page,
-                "Journal": p.jurnal,
-                "Downloaded": p.downloaded,
-                "Downloaded from": dwn_from,
-                "Authors": p.authors
-            })
-
-        # Create a DataFrame and write to CSV
-        df = pd.DataFrame(data, columns=columns)
-        df.to_csv(path, index=False, encoding='utf-8')
+            writer.write(p)
+        writer.close()
 
     def generateBibtex(papers, path):
-        content = ""
+        writer = BibtexWriter(path)
         for p in papers:
-            if p.bibtex is not None:
-                content += p.bibtex + "\n"
-
-        relace_list = ["\ast", "*", "#"]
-        for c in relace_list:
-            content = content.replace(c, "")
-
-        f = open(path, "w", encoding="latin-1", errors="ignore")
-        f.write(str(content))
-        f.close()
+            writer.write(p)
+        writer.close()
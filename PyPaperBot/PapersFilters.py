@@ -4,8 +4,8 @@ Created on Tue Aug 18 12:41:29 2020
 
 @author: Vito
 """
-import pandas as pd
 from difflib import SequenceMatcher
+from .Cache import getCacheDir
 
 
 def similarStrings(a, b):
@@ -20,17 +20,14 @@ Output
     result: list of Paper published by the journals included in the csv
 """
 def filterJurnals(papers,csv_path):
+    from .JournalIndex import loadJournalIndex  # imports numpy, only needed with a journal filter
     result = []
-    df = pd.read_csv(csv_path, sep=";")
-    journal_list = list(df["journal_list"])
-    include_list = list(df["include_list"])
+    index = loadJournalIndex(csv_path, getCacheDir())
 
     for p in papers:
         good = not (p.jurnal is not None and len(p.jurnal) > 0)
-        if p.jurnal is not None:
-            for jurnal, include in zip(journal_list, include_list):
-                if include == 1 and similarStrings(p.jurnal, jurnal) >= 0.8:
-                    good = True
+        if p.jurnal is not None and not good:
+            good = index.matches(p.jurnal)
 
         if good:
             result.append(p)
@@ -53,3 +50,25 @@ def filter_min_date(list_papers,min_year):
             new_list.append(paper)
 
     return new_list
+
+
+"""
+Input
+    papers: iterable of Paper
+    csv_path: journal filter csv as in filterJurnals, None to keep every journal
+    min_year: minimal publication year accepted as in filter_min_date, None to keep every year
+Output
+    generator of the Paper passing both filters, yielded as papers come in
+"""
+def filterPapers(papers, csv_path=None, min_year=None):
+    index = None
+    if csv_path is not None:
+        from .JournalIndex import loadJournalIndex  # imports numpy, only needed with a journal filter
+        index = loadJournalIndex(csv_path, getCacheDir())
+
+    for p in papers:
+        if index is not None and p.jurnal is not None and len(p.jurnal) > 0 and not index.matches(p.jurnal):
+            continue
+        if min_year is not None and (p.year is None or int(p.year) < min_year):
+            continue
+        yield p
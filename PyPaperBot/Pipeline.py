@@ -0,0 +1,65 @@
+import queue
+import threading
+
+QUEUE_SIZE = 32  # items buffered between two stages
+
+
+class Stage:
+    """
+    Runs an iterable in a background thread and hands its items over through a bounded
+    queue, so the consumer works on the first items while the next ones are being
+    produced. The producer blocks when the queue is full. Exceptions raised by the
+    producer are re-raised in the consumer. closed, if given, is an event that closes
+    the stage when it is set, so one event can stop several stages.
+    """
+
+    _DONE = object()
+
+    def __init__(self, iterable, maxsize=QUEUE_SIZE, closed=None):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._closed = closed if closed is not None else threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(iterable,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put(item):
+                    return
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while not self._closed.is_set():
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is self._DONE:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield item
+
+    # Stops the producer at its next item, and the consumer, which may run in another thread
+    def close(self):
+        self._closed.set()
+
+
+# Passes the items of iterable through, appending each one to collected
+def collect(iterable, collected):
+    for item in iterable:
+        collected.append(item)
+        yield item
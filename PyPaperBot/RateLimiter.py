@@ -0,0 +1,139 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from .NetInfo import NetInfo
+
+
+def parseRetryAfter(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Crossref advertises its limit as X-Rate-Limit-Limit requests every X-Rate-Limit-Interval (e.g. "1s")
+def parseCrossrefLimit(headers):
+    limit = headers.get('X-Rate-Limit-Limit')
+    interval = headers.get('X-Rate-Limit-Interval')
+    if limit is None or interval is None:
+        return None
+    try:
+        interval = interval.strip()
+        scale = {'s': 1, 'm': 60, 'h': 3600}.get(interval[-1:], None)
+        seconds = float(interval[:-1]) * scale if scale is not None else float(interval)
+        return float(limit) / seconds if seconds > 0 else None
+    except ValueError:
+        return None
+
+
+class HostBucket:
+    def __init__(self, rate, max_rate):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+
+    def refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+
+class RateLimiter:
+    """
+    Per-host token buckets whose rate adapts with AIMD: every successful response adds
+    increase requests/s (up to max_rate or the limit advertised by the host) and every
+    429/503 or connection failure halves the rate (down to min_rate) and pauses the host
+    for Retry-After seconds or an exponential backoff.
+    """
+
+    def __init__(self, rate, min_rate, max_rate, increase=0.1, backoff=1.0, max_backoff=60.0):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, url):
+        host = urlparse(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = HostBucket(self.rate, self.max_rate)
+        return self._buckets[host]
+
+    # Blocks until a request towards the host of url is allowed
+    def acquire(self, url):
+        while True:
+            with self._lock:
+                bucket = self._bucket(url)
+                now = time.monotonic()
+                bucket.refill(now)
+                if now < bucket.blocked_until:
+                    wait = bucket.blocked_until - now
+                elif bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    return
+                else:
+                    wait = (1 - bucket.tokens) / bucket.rate
+            time.sleep(wait)
+
+    def feedback(self, url, status_code, headers):
+        with self._lock:
+            bucket = self._bucket(url)
+            advertised = parseCrossrefLimit(headers)
+            if advertised is not None:
+                bucket.max_rate = min(self.max_rate, advertised)
+
+            if status_code == 429 or status_code == 503:
+                self._slowDown(bucket, parseRetryAfter(headers.get('Retry-After')))
+            else:
+                bucket.failures = 0
+                bucket.rate = min(bucket.max_rate, bucket.rate + self.increase)
+
+    # Halves the rate towards the host of url and pauses it, returns the pause in seconds
+    def penalize(self, url, retry_after=None):
+        with self._lock:
+            return self._slowDown(self._bucket(url), retry_after)
+
+    def _slowDown(self, bucket, retry_after):
+        bucket.failures += 1
+        bucket.rate = max(self.min_rate, bucket.rate / 2)
+        bucket.tokens = min(bucket.tokens, 0.0)
+        if retry_after is None:
+            retry_after = min(self.max_backoff, self.backoff * 2 ** (bucket.failures - 1))
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+        return retry_after
+
+    def currentRate(self, url):
+        with self._lock:
+            return self._bucket(url).rate
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+# Returns the process-wide limiter shared by every module, configured from NetInfo
+def getLimiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(NetInfo.RATE, NetInfo.MIN_RATE, NetInfo.MAX_RATE)
+    return _limiter
+
+
+def resetLimiter():
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+import threading
+
+REPORT_COLUMNS = ["Name", "Scholar Link", "DOI", "Bibtex", "PDF Name", "Year", "Scholar page", "Journal", "Downloaded",
+                  "Downloaded from", "Authors"]
+REPORT_FORMATS = ("jsonl", "parquet")  # written on request besides result.csv and bibtex.bib
+PARQUET_ROW_GROUP = 10000  # rows buffered before a Parquet row group is written
+
+# Sequences stripped from the BibTeX entries ("\a" is the BEL character)
+BIBTEX_REMOVE = ["\ast", "*", "#"]
+
+
+def reportRow(p):
+    dwn_from = ""
+    if p.downloadedFrom == 1:
+        dwn_from = "SciDB"
+    elif p.downloadedFrom == 2:
+        dwn_from = "SciHub"
+    elif p.downloadedFrom == 3:
+        dwn_from = "Scholar"
+
+    return {
+        "Name": p.title,
+        "Scholar Link": p.scholar_link,
+        "DOI": p.DOI,
+        "Bibtex": p.bibtex is not None,
+        "PDF Name": p.getFileName() if p.downloaded else "",
+        "Year": p.year,
+        "Scholar page": p.scholar_page,
+        "Journal": p.jurnal,
+        "Downloaded": p.downloaded,
+        "Downloaded from": dwn_from,
+        "Authors": p.authors
+    }
+
+
+class CSVReportWriter:
+    """result.csv, one row appended per paper"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file, lineterminator=os.linesep)
+        self.writer.writerow(REPORT_COLUMNS)
+        self.file.flush()
+
+    def write(self, p):
+        row = reportRow(p)
+        self.writer.writerow([row[c] for c in REPORT_COLUMNS])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BibtexWriter:
+    """bibtex.bib, the entry of each paper appended as soon as it is known"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="latin-1", errors="ignore")
+
+    def write(self, p):
+        if p.bibtex is not None:
+            entry = p.bibtex + "\n"
+            for c in BIBTEX_REMOVE:
+                entry = entry.replace(c, "")
+            self.file.write(entry)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLReportWriter:
+    """result.jsonl, the report row of each paper as a JSON object per line"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, p):
+        self.file.write(json.dumps(reportRow(p), ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetReportWriter:
+    """result.parquet, written by row groups of PARQUET_ROW_GROUP papers. Requires pyarrow"""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([(c, pa.bool_() if c in ("Bibtex", "Downloaded") else pa.string())
+                                 for c in REPORT_COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = []
+
+    def write(self, p):
+        row = reportRow(p)
+        for c in ("Year", "Scholar page"):
+            row[c] = str(row[c]) if row[c] is not None else None
+        self.rows.append(row)
+        if len(self.rows) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ReportWriter:
+    """
+    Writes result.csv and bibtex.bib in dwn_dir, plus result.jsonl and result.parquet if listed
+    in formats, appending each paper as soon as it is finished
+    """
+
+    def __init__(self, dwn_dir, formats=()):
+        self.writers = [CSVReportWriter(os.path.join(dwn_dir, "result.csv")),
+                        BibtexWriter(os.path.join(dwn_dir, "bibtex.bib"))]
+        if "jsonl" in formats:
+            self.writers.append(JSONLReportWriter(os.path.join(dwn_dir, "result.jsonl")))
+        if "parquet" in formats:
+            self.writers.append(ParquetReportWriter(os.path.join(dwn_dir, "result.parquet")))
+
+    def write(self, p):
+        for writer in self.writers:
+            writer.write(p)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+class OrderedReport:
+    """
+    Writes the papers finished in any order (e.g. by concurrent downloads) to report in the order they
+    went through number(), which is the order of the former end-of-run report. A paper finished ahead of
+    an earlier one waits in memory until that one is written
+    """
+
+    def __init__(self, report):
+        self.report = report
+        self._numbers = {}  # id(paper) -> its number
+        self._waiting = {}  # number -> paper finished ahead of its turn
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    # Passes the papers through, numbering them in the order they come
+    def number(self, papers):
+        for p in papers:
+            with self._lock:
+                self._numbers[id(p)] = self._count
+                self._count += 1
+            yield p
+
+    def write(self, p):
+        with self._lock:
+            self._waiting[self._numbers.pop(id(p))] = p
+            while self._next in self._waiting:
+                self.report.write(self._waiting.pop(self._next))
+                self._next += 1
+
+    # The papers still waiting (behind papers that were never finished) are written in their order
+    def close(self):
+        with self._lock:
+            for n in sorted(self._waiting):
+                self.report.write(self._waiting.pop(n))
+            self._numbers.clear()
+        self.report.close()
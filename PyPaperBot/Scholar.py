@@ -1,11 +1,14 @@
+import atexit
 import time
-import requests
 import functools
-import undetected_chromedriver as uc
-from selenium.webdriver.chrome.options import Options
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .HTMLparsers import schoolarParser
-from .Crossref import getPapersInfo
+from .Crossref import iterPapersInfo
 from .NetInfo import NetInfo
+from .Metrics import getMetrics
+from . import HTTPClient
 
 
 def waithIPchange():
@@ -20,31 +23,151 @@ def waithIPchange():
             return True
 
 
-def scholar_requests(scholar_pages, url, restrict, chrome_version, scholar_results=10):
-    javascript_error = "Sorry, we can't verify that you're not a robot when JavaScript is turned off"
-    to_download = []
-    driver = None
-    for i in scholar_pages:
-        while True:
-            res_url = url % (scholar_results * (i - 1))
-            if chrome_version is not None:
-                if driver is None:
-                    print("Using Selenium driver")
-                    options = Options()
-                    options.add_argument('--headless')
-                    driver = uc.Chrome(headless=True, use_subprocess=False, version_main=chrome_version)
-                driver.get(res_url)
+JAVASCRIPT_ERROR = "Sorry, we can't verify that you're not a robot when JavaScript is turned off"
+
+_block_lock = threading.Lock()
+
+
+class ScholarPagePool:
+    """
+    Bounded pool of workers fetching Scholar pages concurrently. Each worker has its own
+    identity: a headless Chrome driver if chrome_version is given (started once, the first
+    time the worker is used) or plain HTTP requests otherwise, going through the proxy of
+    the worker if proxies are configured. A worker detecting the JavaScript block asks the
+    user to change IP, one worker at a time.
+    """
+
+    def __init__(self, workers=1, chrome_version=None, proxies=None):
+        self.workers = workers
+        self.chrome_version = chrome_version
+        self.proxies = list(proxies) if proxies else []
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scholar")
+        self._local = threading.local()
+        self._drivers = []
+        self._lock = threading.Lock()
+        self._assigned = 0
+        self._stopped = False
+
+    def _identity(self):
+        if not hasattr(self._local, "proxy"):
+            with self._lock:
+                n = self._assigned
+                self._assigned += 1
+            self._local.proxy = self.proxies[n % len(self.proxies)] if self.proxies else None
+            self._local.driver = None
+            if self.chrome_version is not None:
+                # Selenium is only imported when a browser is used
+                import undetected_chromedriver as uc
+                from selenium.webdriver.chrome.options import Options
+                print("Using Selenium driver")
+                options = Options()
+                options.add_argument('--headless')
+                if self._local.proxy is not None:
+                    options.add_argument('--proxy-server={}'.format(self._local.proxy))
+                self._local.driver = uc.Chrome(options=options, headless=True, use_subprocess=False,
+                                               version_main=self.chrome_version)
+                with self._lock:
+                    self._drivers.append(self._local.driver)
+        return self._local.proxy, self._local.driver
+
+    # Returns the html of the page at url, None if the user chose to stop after a block
+    def fetch(self, url):
+        while not self._stopped:
+            proxy, driver = self._identity()
+            if driver is not None:
+                t = time.time()
+                driver.get(url)
                 html = driver.page_source
+                getMetrics().request("scholar page", url, None, time.time() - t, 200, size=len(html))
+            elif proxy is not None:
+                html = HTTPClient.get(url, proxies={"http": proxy, "https": proxy}, stage="scholar page").text
             else:
-                html = requests.get(res_url, headers=NetInfo.HEADERS)
-                html = html.text
+                html = HTTPClient.get(url, stage="scholar page").text
 
-            if javascript_error in html:
-                is_continue = waithIPchange()
-                if not is_continue:
-                    return to_download
-            else:
+            if JAVASCRIPT_ERROR not in html:
+                return html
+            with _block_lock:
+                if not self._stopped and not waithIPchange():
+                    self._stopped = True
+        return None
+
+    def timedFetch(self, url):
+        with getMetrics().timed("scholar"):
+            return self.fetch(url)
+
+    def submit(self, url):
+        return self._executor.submit(self.timedFetch, url)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for driver in self._drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        self._drivers = []
+
+
+_pools = {}
+
+
+# Returns the page pool for the given settings, created once per process and reused by later runs
+def getPagePool(workers=1, chrome_version=None, proxies=None):
+    key = (workers, chrome_version, tuple(proxies) if proxies else ())
+    pool = _pools.get(key)
+    if pool is None or pool._stopped:
+        if pool is not None:
+            pool.close()  # its fetches return at once once stopped, its browsers are quit
+        pool = ScholarPagePool(workers, chrome_version, proxies)
+        _pools[key] = pool
+    return pool
+
+
+@atexit.register
+def closePagePools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+
+# Fetches the pages through the pool and yields (page, html) in page order
+def fetchPages(pool, pages, url, scholar_results):
+    pending = deque()
+    pages = iter(pages)
+    while True:
+        while len(pending) < 2 * pool.workers:
+            i = next(pages, None)
+            if i is None:
                 break
+            pending.append((i, pool.submit(url % (scholar_results * (i - 1)))))
+        if not pending:
+            return
+
+        i, future = pending.popleft()
+        html = future.result()
+        if html is None:
+            for _, f in pending:
+                f.cancel()
+            return
+        yield i, html
+
+
+# Yields the Paper of each Scholar result as soon as it has been resolved on Crossref
+def scholar_requests(scholar_pages, url, restrict, chrome_version, scholar_results=10, journal=None, resumed_pages=None,
+                     workers=1, proxies=None):
+    resumed_pages = resumed_pages if resumed_pages is not None else {}
+    pool = getPagePool(workers, chrome_version, proxies)
+    fetched = fetchPages(pool, [i for i in scholar_pages if i not in resumed_pages], url, scholar_results)
+    for i in scholar_pages:
+        if i in resumed_pages:
+            print("\nGoogle Scholar page {} : restored from the journal".format(i))
+            yield from resumed_pages[i]
+            continue
+
+        page = next(fetched, None)
+        if page is None:
+            return  # stopped after a block
+        i, html = page
 
         papers = schoolarParser(html)
         if len(papers) > scholar_results:
@@ -53,19 +176,22 @@ def scholar_requests(scholar_pages, url, restrict, chrome_version, scholar_resul
         print("\nGoogle Scholar page {} : {} papers found".format(i, scholar_results))
 
         if len(papers) > 0:
-            papersInfo = getPapersInfo(papers, url, restrict, scholar_results)
+            papersInfo = []
+            for paper in iterPapersInfo(papers, url, restrict):
+                papersInfo.append(paper)
+                yield paper
             info_valids = functools.reduce(lambda a, b: a + 1 if b.DOI is not None else a, papersInfo, 0)
             print("Papers found on Crossref: {}/{}\n".format(info_valids, len(papers)))
 
-            to_download.append(papersInfo)
+            if journal is not None:
+                journal.pageResolved(i, papersInfo)
         else:
             print("Paper not found...")
 
-    return to_download
 
-
-def ScholarPapersInfo(query, scholar_pages, restrict, min_date=None, scholar_results=10, chrome_version=None, cites=None):
-    url = r"https://scholar.google.com/scholar?hl=en&as_vis=1&as_sdt=1,5&start=%d"
+# Search link of a query, with %d in place of the index of the first result of the page
+def scholarURL(query, cites=None, min_date=None):
+    url = NetInfo.Scholar_URL + r"?hl=en&as_vis=1&as_sdt=1,5&start=%d"
     if query:
         if len(query) > 7 and (query.startswith("http://") or query.startswith("https://")):
             url = query
@@ -75,7 +201,28 @@ def ScholarPapersInfo(query, scholar_pages, restrict, min_date=None, scholar_res
         url += f"&cites={cites}"
     if min_date:
         url += f"&as_ylo={min_date}"
+    return url
+
+
+# Generator of the Paper of each Scholar result, in page order
+def iterScholarPapersInfo(query, scholar_pages, restrict, min_date=None, scholar_results=10, chrome_version=None,
+                          cites=None, journal=None, resumed_pages=None, workers=1, proxies=None):
+    return scholar_requests(scholar_pages, scholarURL(query, cites, min_date), restrict, chrome_version,
+                            scholar_results, journal, resumed_pages, workers, proxies)
+
+
+# Yields the search link and the parsed results of each Scholar page, not resolved on Crossref
+def iterScholarResults(query, scholar_pages, min_date=None, scholar_results=10, chrome_version=None, cites=None,
+                       workers=1, proxies=None):
+    url = scholarURL(query, cites, min_date)
+    pool = getPagePool(workers, chrome_version, proxies)
+    for i, html in fetchPages(pool, scholar_pages, url, scholar_results):
+        results = schoolarParser(html)[0:scholar_results]
+        print("Google Scholar page {} : {} papers found".format(i, len(results)))
+        yield url, results
 
-    to_download = scholar_requests(scholar_pages, url, restrict, chrome_version, scholar_results)
 
-    return [item for sublist in to_download for item in sublist]
+def ScholarPapersInfo(query, scholar_pages, restrict, min_date=None, scholar_results=10, chrome_version=None, cites=None,
+                      journal=None, resumed_pages=None, workers=1, proxies=None):
+    return list(iterScholarPapersInfo(query, scholar_pages, restrict, min_date, scholar_results, chrome_version, cites,
+                                      journal, resumed_pages, workers, proxies))
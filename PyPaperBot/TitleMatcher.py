@@ -0,0 +1,41 @@
+from difflib import SequenceMatcher
+
+TITLE_SIMILARITY = 0.75  # a Crossref title matches a Scholar title if their ratio is above this
+
+
+def normalizeTitle(title):
+    return title.lower()
+
+
+class TitleMatcher:
+    """
+    Decides whether candidate titles match a reference title, i.e. whether
+    similarStrings(title.lower(), candidate.lower()) > threshold.
+
+    The reference title is normalized once and each candidate is checked against the cheap
+    upper bounds real_quick_ratio and quick_ratio before computing the full ratio, so most
+    non-matching candidates are discarded without running the matching blocks search.
+    """
+
+    def __init__(self, title, threshold=TITLE_SIMILARITY):
+        self.title = normalizeTitle(title)
+        self.threshold = threshold
+        self._matcher = SequenceMatcher(None)
+        self._matcher.set_seq1(self.title)
+
+    # Returns the similarity ratio with candidate, or None if it is certainly not above the threshold
+    def score(self, candidate):
+        m = self._matcher
+        m.set_seq2(normalizeTitle(candidate))
+        if m.real_quick_ratio() <= self.threshold or m.quick_ratio() <= self.threshold:
+            return None
+        ratio = m.ratio()
+        return ratio if ratio > self.threshold else None
+
+    def matches(self, candidate):
+        return self.score(candidate) is not None
+
+    # Scores a whole batch of candidates, returning a list of ratios (None for the non-matching ones)
+    def scoreAll(self, candidates):
+        return [self.score(candidate) for candidate in candidates]
+
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+LEASE_SECONDS = 300  # a claimed item goes back to the queue if its worker does not renew the lease in time
+MAX_ATTEMPTS = 3  # claims of an item before it is given up
+# Items claimed at once by a worker: DOIs are resolved on Crossref by batches, Scholar results one by one
+CLAIM_SIZES = {"doi": 50, "scholar": 10}
+
+
+class WorkQueue:
+    """
+    Work items of a run shared by several processes through an SQLite file: DOIs or Scholar
+    results added by a coordinator, claimed by the workers with a lease they renew while working
+    on them and marked done with their result. The items of a worker that died are claimed again
+    once their lease has expired, up to MAX_ATTEMPTS times. The coordinator seals the queue once
+    every item is added, workers stop when it is sealed and drained. The rollback journal is kept
+    (not WAL) so the file can also be shared by hosts through a network filesystem with working locks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, kind TEXT, payload TEXT, "
+                           "state TEXT DEFAULT 'pending', worker TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, "
+                           "result TEXT, error TEXT, UNIQUE (kind, payload))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    # Write transaction, taken at once so that two processes never claim the same items
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # Adds the items not already in the queue, returns how many were added
+    def enqueue(self, kind, payloads):
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO items (kind, payload) VALUES (?, ?)",
+                             ((kind, payload) for payload in payloads))
+            return conn.total_changes - before
+
+    # Gives up the expired items already claimed MAX_ATTEMPTS times
+    def _expire(self, conn, now):
+        conn.execute("UPDATE items SET state = 'failed', error = 'lease expired' "
+                     "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+
+    def expire(self):
+        with self._transaction() as conn:
+            self._expire(conn, time.time())
+
+    # Returns the next items (id, kind, payload) of the same kind, up to CLAIM_SIZES, leased to worker for lease seconds
+    def claim(self, worker, lease=LEASE_SECONDS):
+        now = time.time()
+        claimable = "(state = 'pending' OR (state = 'leased' AND lease_until < ?))"
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            first = conn.execute("SELECT kind FROM items WHERE " + claimable + " ORDER BY id LIMIT 1", (now,)).fetchone()
+            if first is None:
+                return []
+            kind = first[0]
+            items = conn.execute("SELECT id, kind, payload FROM items WHERE kind = ? AND " + claimable +
+                                 " ORDER BY id LIMIT ?", (kind, now, CLAIM_SIZES.get(kind, 1))).fetchall()
+            conn.executemany("UPDATE items SET state = 'leased', worker = ?, lease_until = ?, "
+                             "attempts = attempts + 1 WHERE id = ?", ((worker, now + lease, i) for i, _, _ in items))
+        return items
+
+    # Extends the leases of the items worker is working on
+    def renew(self, worker, lease=LEASE_SECONDS):
+        with self._transaction() as conn:
+            conn.execute("UPDATE items SET lease_until = ? WHERE worker = ? AND state = 'leased'",
+                         (time.time() + lease, worker))
+
+    # Marks the item as done with result (None if there is nothing to report), False if its lease was lost
+    def complete(self, item_id, worker, result):
+        with self._transaction() as conn:
+            return conn.execute("UPDATE items SET state = 'done', result = ?, lease_until = NULL "
+                                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                                (json.dumps(result) if result is not None else None, item_id, worker)).rowcount == 1
+
+    # Puts the item back in the queue, or gives it up after MAX_ATTEMPTS
+    def fail(self, item_id, worker, error):
+        with self._transaction() as conn:
+            conn.execute("UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                         "error = ?, worker = NULL, lease_until = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+                         (MAX_ATTEMPTS, error, item_id, worker))
+
+    # Marks whether the coordinator has added every item, workers wait for more items until then
+    def setSealed(self, sealed):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sealed', ?)", ("1" if sealed else "0",))
+
+    def isSealed(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'sealed'").fetchone()
+        return row is not None and row[0] == "1"
+
+    # True once the queue is sealed and every item is done or failed
+    def drained(self):
+        return self.isSealed() and self.unfinished() == 0
+
+    # Number of items by state: pending, leased, done and failed
+    def counts(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in ("pending", "leased", "done", "failed")}
+
+    def unfinished(self):
+        counts = self.counts()
+        return counts["pending"] + counts["leased"]
+
+    # Results of the items done, in the order they were added, read through a connection of their own
+    def results(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            for (result,) in conn.execute("SELECT result FROM items WHERE state = 'done' AND result IS NOT NULL "
+                                          "ORDER BY id"):
+                yield json.loads(result)
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,158 @@
+import json
+import os
+import socket
+import threading
+import time
+from .Crossref import getPapersInfoFromDOIsBatch, iterBibtex, searchPapers
+from .Downloader import downloadPapers, setMirrors, saveMirrors, HostLimiter
+from .Library import Library
+from .Paper import Paper
+from .PapersFilters import filterPapers
+from .Reports import ReportWriter
+from .WorkQueue import WorkQueue, LEASE_SECONDS
+
+POLL_SECONDS = 5  # wait of an idle worker, and between two progress lines of the coordinator
+ENQUEUE_BATCH = 1000  # DOIs added to the queue with a single transaction
+
+
+# Adds the DOIs to the queue as they are read, returns the number of new items
+def enqueueDOIs(queue, DOIs, batch_size=ENQUEUE_BATCH):
+    added = 0
+    batch = []
+    for DOI in DOIs:
+        batch.append(DOI)
+        if len(batch) == batch_size:
+            added += queue.enqueue("doi", batch)
+            batch = []
+    if len(batch) > 0:
+        added += queue.enqueue("doi", batch)
+    return added
+
+
+# Adds the results of each Scholar page (see iterScholarResults) as soon as it is parsed
+def enqueueScholar(queue, pages):
+    added = 0
+    for url, results in pages:
+        added += queue.enqueue("scholar", [json.dumps({"url": url, "result": r}, sort_keys=True) for r in results])
+    return added
+
+
+# Waits until the workers have processed every item, then writes the report of the results in dwn_dir
+def waitQueue(queue, dwn_dir, report_formats=()):
+    last = None
+    while True:
+        queue.expire()
+        counts = queue.counts()
+        if counts != last:
+            print("Queue: {pending} pending, {leased} in progress, {done} done, {failed} failed".format(**counts))
+            last = counts
+        if counts["pending"] + counts["leased"] == 0:
+            break
+        time.sleep(POLL_SECONDS)
+
+    report = ReportWriter(dwn_dir, report_formats)
+    for result in queue.results():
+        report.write(Paper.fromDict(result))
+    report.close()
+    return last
+
+
+def renewLeases(queue, worker, stop):
+    while not stop.wait(LEASE_SECONDS / 3):
+        try:
+            queue.renew(worker)
+        except Exception as e:
+            print("Lease renewal failed: {}".format(e))
+
+
+# Resolves the claimed items on Crossref, returns the list of (item id, Paper)
+def resolveItems(items, restrict, crossref_workers, use_doi_as_filename):
+    DOI_items = [(i, payload) for i, kind, payload in items if kind == "doi"]
+    resolved = list(zip([i for i, _ in DOI_items],
+                        getPapersInfoFromDOIsBatch([DOI for _, DOI in DOI_items], restrict,
+                                                   max_workers=crossref_workers)))
+    for _, p in resolved:
+        p.use_doi_as_filename = use_doi_as_filename
+
+    searches = {}  # Scholar search link -> [(item id, result)]
+    for i, kind, payload in items:
+        if kind == "scholar":
+            item = json.loads(payload)
+            searches.setdefault(item["url"], []).append((i, item["result"]))
+    for url, results in searches.items():
+        papers = iterBibtex(searchPapers([r for _, r in results], url), restrict)
+        resolved += list(zip([i for i, _ in results], papers))
+    return resolved
+
+
+def runWorker(queue_path, dwn_dir, restrict=None, min_date=None, filter_jurnal_file=None, SciHub_URL=None,
+              SciDB_URL=None, download_workers=1, max_per_host=2, crossref_workers=4, hedge_delay=None,
+              library_dir=None, use_doi_as_filename=False):
+    """
+    Input:
+        queue_path: SQLite file of the work queue
+        The other arguments are those of start
+    Output:
+        number of items processed. The worker stops once the queue is sealed and no item is left to claim or in progress
+    """
+    queue = WorkQueue(queue_path)
+    worker = "{}-{}".format(socket.gethostname(), os.getpid())
+    stop = threading.Event()
+    threading.Thread(target=renewLeases, args=(queue, worker, stop), daemon=True).start()
+    library = Library(library_dir) if library_dir is not None else None
+    limiter = HostLimiter(max_per_host)
+    mirrors = None  # set up with the first paper to download, then kept for the whole run
+    processed = 0
+
+    print("Worker {} started on {}".format(worker, queue_path))
+    try:
+        while True:
+            items = queue.claim(worker)
+            if len(items) == 0:
+                if queue.drained():
+                    break
+                # The coordinator may still be adding items, and items leased by other workers may come back
+                time.sleep(POLL_SECONDS)
+                continue
+            print("Worker {}: {} items claimed".format(worker, len(items)))
+
+            item_of = {}  # id(paper) -> item id
+            completed = set()
+
+            def report(p, result):
+                queue.complete(item_of[id(p)], worker, result)
+                completed.add(item_of[id(p)])
+
+            try:
+                papers = resolveItems(items, restrict, crossref_workers, use_doi_as_filename)
+                item_of.update((id(p), i) for i, p in papers)
+                if restrict != 0:
+                    to_download = list(filterPapers([p for _, p in papers], filter_jurnal_file, min_date))
+                    if mirrors is None and any(p.canBeDownloaded() for p in to_download):
+                        mirrors = setMirrors(SciHub_URL, SciDB_URL)
+                    downloadPapers(to_download, dwn_dir, None, SciHub_URL, SciDB_URL, download_workers, max_per_host,
+                                   hedge_delay, library=library, on_done=lambda p: report(p, p.toDict()),
+                                   mirrors=mirrors, limiter=limiter)
+                    # What is left was filtered out, done but not in the report
+                    for i, p in papers:
+                        if i not in completed:
+                            report(p, None)
+                else:
+                    for _, p in papers:
+                        report(p, p.toDict())
+            except Exception as e:
+                print("Worker {}: {}".format(worker, e))
+                for i, _, _ in items:
+                    if i not in completed:
+                        queue.fail(i, worker, str(e))
+            processed += len(items)
+    finally:
+        stop.set()
+        if mirrors is not None and SciHub_URL is None:
+            saveMirrors(mirrors)
+        if library is not None:
+            library.close()
+        queue.close()
+
+    print("Worker {} finished: {} items processed".format(worker, processed))
+    return processed
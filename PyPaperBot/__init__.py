@@ -1 +1,9 @@
 __version__= "1.4.0"
+
+
+# The client is imported on first use, so that the command line does not load what it does not need
+def __getattr__(name):
+    if name == "PaperBotClient":
+        from .Client import PaperBotClient
+        return PaperBotClient
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
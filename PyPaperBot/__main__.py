@@ -1,81 +1,240 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
 import sys
 import os
+import threading
 import time
-import requests
-from .Paper import Paper
-from .PapersFilters import filterJurnals, filter_min_date, similarStrings
+from .PapersFilters import filterPapers
+from .Paper import BibtexStore, spillBibtex
 from .Downloader import downloadPapers
-from .Scholar import ScholarPapersInfo
-from .Crossref import getPapersInfoFromDOIs
+from .Scholar import iterScholarPapersInfo, iterScholarResults
+from .Pipeline import Stage
+from .Reports import ReportWriter, OrderedReport, REPORT_FORMATS
+from .Crossref import getPapersInfoFromDOIsBatch
 from .proxy import proxy
+from .Library import Library
+from .WorkQueue import WorkQueue
+from .Workers import enqueueDOIs, enqueueScholar, waitQueue, runWorker
+from .DOIList import uniqueDOIs, readDOIFile, parseShard
+from .JobJournal import JobJournal, JournalState, loadJournal, restoreDownloads, runHeader
+from .NetInfo import NetInfo
+from . import HTTPClient
+from . import Cache
+from . import RateLimiter
+from . import HTMLparsers
+from . import Metrics
 from .__init__ import __version__
 from urllib.parse import urljoin
 
-def checkVersion():
+VERSION_FILE = "version_check.json"
+VERSION_CHECK_TTL = 24 * 3600  # seconds the latest version read from PyPI is reused
+
+_latest_version = None
+
+
+def fetchLatestVersion(path):
+    global _latest_version
     try :
-        print("PyPaperBot v" + __version__)
-        response = requests.get('https://pypi.org/pypi/pypaperbot/json')
-        latest_version = response.json()['info']['version']
-        if latest_version != __version__:
-            print("NEW VERSION AVAILABLE!\nUpdate with 'pip install PyPaperBot —upgrade' to get the latest features!\n")
+        response = HTTPClient.get('https://pypi.org/pypi/pypaperbot/json', retries=0, timeout=(3, 5),
+                                  stage="version check")
+        _latest_version = response.json()['info']['version']
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"checked": time.time(), "latest": _latest_version}, f)
+        os.replace(path + ".tmp", path)
     except :
         pass
 
 
+# Looks for a newer version on PyPI. The answer is cached in cache_dir for VERSION_CHECK_TTL, otherwise it is
+# fetched in the background. Returns the background thread, None if the cached answer was used
+def checkVersion(cache_dir=Cache.DEFAULT_CACHE_DIR):
+    global _latest_version
+    path = os.path.join(cache_dir, VERSION_FILE)
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if time.time() - cached["checked"] < VERSION_CHECK_TTL:
+            _latest_version = cached["latest"]
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    thread = threading.Thread(target=fetchLatestVersion, args=(path,), daemon=True)
+    thread.start()
+    return thread
+
+
+def versionNotice():
+    if _latest_version is not None and _latest_version != __version__:
+        print("NEW VERSION AVAILABLE!\nUpdate with 'pip install PyPaperBot —upgrade' to get the latest features!\n")
+
+
+# Yields the Paper of each DOI as DOIs are read, resolving on Crossref only those missing from the journal
+def resolveDOIs(DOIs, restrict, use_doi_as_filename, crossref_workers, journal, state):
+    restored = set()  # ids of the papers of the journal on their way through the Crossref stages
+    num_restored = 0
+
+    # The papers of the journal go through in place of their DOI, and are handed over as soon as they are read
+    def pending():
+        nonlocal num_restored
+        for DOI in DOIs:
+            if DOI in state.dois:
+                p = state.dois[DOI]
+                restored.add(id(p))
+                num_restored += 1
+                yield p
+            else:
+                yield DOI
+
+    num = 1
+    for papersInfo in getPapersInfoFromDOIsBatch(pending(), restrict, max_workers=crossref_workers):
+        if id(papersInfo) in restored:
+            restored.discard(id(papersInfo))
+            yield papersInfo
+            continue
+        print("Found paper {} with DOI {}".format(num, papersInfo.DOI))
+        papersInfo.use_doi_as_filename = use_doi_as_filename
+        journal.doiResolved(papersInfo.DOI, papersInfo)
+        num += 1
+        yield papersInfo
+
+    if num_restored > 0:
+        print("{} DOIs restored from the journal".format(num_restored))
+
+
+def restoreFromJournal(papers, state, dwn_dir):
+    metrics = Metrics.getMetrics()
+    for p in papers:
+        metrics.count("papers found")
+        if restoreDownloads([p], state, dwn_dir) > 0:
+            print("Already downloaded by the interrupted run -> {}".format(p.title))
+        yield p
+
+
 def start(query, scholar_results, scholar_pages, dwn_dir, proxy, min_date=None, num_limit=None, num_limit_type=None,
           filter_jurnal_file=None, restrict=None, DOIs=None, SciHub_URL=None, chrome_version=None, cites=None,
-          use_doi_as_filename=False, SciDB_URL=None):
+          use_doi_as_filename=False, SciDB_URL=None, download_workers=1, max_per_host=2, crossref_workers=4, hedge_delay=None,
+          resume=False, library_dir=None, scholar_workers=1, scholar_proxies=None, progress=False, report_formats=(),
+          bibtex_on_disk=False, doi_source=None):
 
     if SciDB_URL is not None and "/scidb" not in SciDB_URL:
         SciDB_URL = urljoin(SciDB_URL, "/scidb/")
 
-    to_download = []
+    # Every host gets a pool large enough for the concurrent requests allowed towards it
+    if max_per_host > NetInfo.POOL_MAXSIZE:
+        NetInfo.POOL_MAXSIZE = max_per_host
+        HTTPClient.resetSession()
+
+    # A journal of another query must not be resumed into this run
+    header = runHeader(query, cites, min_date, scholar_results, doi_source)
+    state = loadJournal(dwn_dir) if resume else JournalState()
+    if state.header is not None and state.header != header:
+        print("Error: the journal in {} was written by another run ({}), --resume needs the same --query, --cites, "
+              "--min-year, --scholar-results and --doi/--doi-file".format(dwn_dir, state.header))
+        sys.exit()
+
+    # Timings and counters of the run, written to metrics.json and metrics.prom in dwn_dir
+    reporter = Metrics.Reporter(Metrics.resetMetrics(), dwn_dir, progress)
+
+    library = Library(library_dir) if library_dir is not None else None
+    journal = JobJournal(dwn_dir, resume, header)
+
     if DOIs is None:
         print("Query: {}".format(query))
         print("Cites: {}".format(cites))
-        to_download = ScholarPapersInfo(query, scholar_pages, restrict, min_date, scholar_results, chrome_version, cites)
+        papers = iterScholarPapersInfo(query, scholar_pages, restrict, min_date, scholar_results, chrome_version, cites,
+                                       journal, state.pages, scholar_workers, scholar_proxies)
     else:
         print("Downloading papers from DOIs\n")
-        num = 1
-        i = 0
-        while i < len(DOIs):
-            DOI = DOIs[i]
-            print("Searching paper {} of {} with DOI {}".format(num, len(DOIs), DOI))
-            papersInfo = getPapersInfoFromDOIs(DOI, restrict)
-            papersInfo.use_doi_as_filename = use_doi_as_filename
-            to_download.append(papersInfo)
+        papers = resolveDOIs(DOIs, restrict, use_doi_as_filename, crossref_workers, journal, state)
+    papers = restoreFromJournal(papers, state, dwn_dir)
+
+    # The BibTeX entries of the run are kept in a temporary file of dwn_dir, deleted at the end of the run
+    bibtex_store = BibtexStore(dwn_dir) if bibtex_on_disk else None
+    if bibtex_store is not None:
+        papers = spillBibtex(papers, bibtex_store)
+
+    # The report and BibTeX files get each paper once it is finished, in the order the papers are found (or sorted)
+    writer = ReportWriter(dwn_dir, report_formats)
+    report = OrderedReport(writer)
+
+    if restrict != 0:
+        papers = filterPapers(papers, filter_jurnal_file, min_date)
+
+        if num_limit_type is None:
+            # Nothing to sort: each paper flows to the downloads as soon as it is resolved
+            stage = Stage(report.number(papers))
+            try:
+                downloadPapers(stage, dwn_dir, num_limit, SciHub_URL, SciDB_URL, download_workers, max_per_host,
+                               hedge_delay, journal, library, report.write)
+            finally:
+                stage.close()
+        else:
+            to_download = list(papers)
 
-            num += 1
-            i += 1
+            if num_limit_type == 0:
+                to_download.sort(key=lambda x: int(x.year) if x.year is not None else 0, reverse=True)
 
-    if restrict != 0 and to_download:
-        if filter_jurnal_file is not None:
-            to_download = filterJurnals(to_download, filter_jurnal_file)
+            if num_limit_type == 1:
+                to_download.sort(key=lambda x: int(x.cites_num) if x.cites_num is not None else 0, reverse=True)
 
-        if min_date is not None:
-            to_download = filter_min_date(to_download, min_date)
+            to_download = list(report.number(to_download))
+            downloadPapers(to_download, dwn_dir, num_limit, SciHub_URL, SciDB_URL, download_workers, max_per_host,
+                           hedge_delay, journal, library, report.write)
+    else:
+        for p in papers:
+            writer.write(p)
 
-        if num_limit_type is not None and num_limit_type == 0:
-            to_download.sort(key=lambda x: int(x.year) if x.year is not None else 0, reverse=True)
+    report.close()
+    journal.close()
+    if library is not None:
+        library.close()
+    if bibtex_store is not None:
+        bibtex_store.close()
+    reporter.stop()
 
-        if num_limit_type is not None and num_limit_type == 1:
-            to_download.sort(key=lambda x: int(x.cites_num) if x.cites_num is not None else 0, reverse=True)
 
-        downloadPapers(to_download, dwn_dir, num_limit, SciHub_URL, SciDB_URL)
+# Coordinator or worker of a run through a work queue, see WorkQueue
+def runQueue(args, scholar_pages, DOIs, dwn_dir):
+    SciDB_URL = args.annas_archive_mirror
+    if SciDB_URL is not None and "/scidb" not in SciDB_URL:
+        SciDB_URL = urljoin(SciDB_URL, "/scidb/")
+    if args.max_per_host > NetInfo.POOL_MAXSIZE:
+        NetInfo.POOL_MAXSIZE = args.max_per_host
+        HTTPClient.resetSession()
 
-    Paper.generateReport(to_download, dwn_dir + "result.csv")
-    Paper.generateBibtex(to_download, dwn_dir + "bibtex.bib")
+    if args.worker:
+        runWorker(args.queue, dwn_dir, args.restrict, args.min_year, args.journal_filter, args.scihub_mirror,
+                  SciDB_URL, args.download_workers, args.max_per_host, args.crossref_workers, args.hedge_delay,
+                  args.library_dir, args.use_doi_as_filename)
+        return
+
+    queue = WorkQueue(args.queue)
+    queue.setSealed(False)  # workers wait for the items still to come
+    print("Adding items to the queue {}, the workers can be started with --queue {} --worker".format(args.queue,
+                                                                                                  args.queue))
+    if DOIs is not None:
+        added = enqueueDOIs(queue, DOIs)
+    else:
+        added = enqueueScholar(queue, iterScholarResults(args.query, scholar_pages, args.min_year,
+                                                         args.scholar_results, args.selenium_chrome_version,
+                                                         args.cites, args.scholar_workers, args.scholar_proxies))
+    queue.setSealed(True)
+    print("{} items added to the queue {}".format(added, args.queue))
+    counts = waitQueue(queue, dwn_dir, args.report_formats)
+    print("Queue processed: {done} items done, {failed} failed".format(**counts))
+    queue.close()
 
 
 def main():
+    print("PyPaperBot v" + __version__)
     print(
         """PyPaperBot is a Python tool for downloading scientific papers using Google Scholar, Crossref and SciHub.
         -Join the telegram channel to stay updated --> https://t.me/pypaperbotdatawizards <--
         -If you like this project, you can share a cup of coffee at --> https://www.paypal.com/paypalme/ferru97 <-- :)\n""")
-    time.sleep(4)
     parser = argparse.ArgumentParser(
         description='PyPaperBot is python tool to search and dwonload scientific papers using Google Scholar, Crossref and SciHub')
     parser.add_argument('--query', type=str, default=None,
@@ -86,6 +245,8 @@ def main():
                         help='DOI of the paper to download (this option uses only SciHub to download)')
     parser.add_argument('--doi-file', type=str, default=None,
                         help='File .txt containing the list of paper\'s DOIs to download')
+    parser.add_argument('--shard', type=str, default=None,
+                        help='Process only the i-th of N disjoint slices of --doi-file, given as i/N (e.g. 2/4), so that N runs can share the same file')
     parser.add_argument('--scholar-pages', type=str,
                         help='If given in %%d format, the number of pages to download from the beginning. '
                              'If given in %%d-%%d format, the range of pages (starting from 1) to download (the end is included). '
@@ -114,6 +275,50 @@ def main():
                         help='First three digits of the chrome version installed on your machine. If provided, selenium will be used for scholar search. It helps avoid bot detection but chrome must be installed.')
     parser.add_argument('--use-doi-as-filename', action='store_true', default=False,
                         help='Use DOIs as output file names')
+    parser.add_argument('--cache-dir', type=str, default=Cache.DEFAULT_CACHE_DIR,
+                        help='Directory of the persistent Crossref metadata cache (default {})'.format(Cache.DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache-ttl', type=float, default=Cache.DEFAULT_TTL / 86400,
+                        help='Days after which cached Crossref metadata is fetched again (default 30)')
+    parser.add_argument('--cache-max-entries', type=int, default=Cache.DEFAULT_MAX_ENTRIES,
+                        help='Maximum number of cached Crossref responses, least recently used are evicted first')
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='Do not read or write the Crossref metadata cache')
+    parser.add_argument('--hedge-delay', type=float, default=None,
+                        help='If given, the next download source of a paper is started when the previous ones did not deliver a PDF within this many seconds (0 starts all sources at once)')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='Resume an interrupted run in --dwn-dir from its journal, skipping the papers already resolved or downloaded')
+    parser.add_argument('--library-dir', type=str, default=None,
+                        help='Directory of a library shared across runs: PDFs are stored there once by content and linked into --dwn-dir, papers already held are not downloaded again')
+    parser.add_argument('--scholar-workers', type=int, default=1,
+                        help='Number of Google Scholar pages fetched concurrently, each worker with its own browser when selenium is used (default 1)')
+    parser.add_argument('--scholar-proxies', nargs='+', default=None,
+                        help='Proxies assigned in turn to the Google Scholar workers (e.g. http://1.1.1.1:8080)')
+    parser.add_argument('--crossref-workers', type=int, default=4,
+                        help='Number of batched Crossref DOI lookups to run concurrently (default 4)')
+    parser.add_argument('--rate', type=float, default=NetInfo.RATE,
+                        help='Starting number of requests per second towards each host, adapted at runtime (default {})'.format(NetInfo.RATE))
+    parser.add_argument('--min-rate', type=float, default=NetInfo.MIN_RATE,
+                        help='Minimum requests per second towards each host after slow-downs (default {})'.format(NetInfo.MIN_RATE))
+    parser.add_argument('--max-rate', type=float, default=NetInfo.MAX_RATE,
+                        help='Maximum requests per second towards each host (default {})'.format(NetInfo.MAX_RATE))
+    parser.add_argument('--download-workers', type=int, default=1,
+                        help='Number of papers to download concurrently (default 1)')
+    parser.add_argument('--max-per-host', type=int, default=2,
+                        help='Maximum number of concurrent requests towards the same mirror or host (default 2)')
+    parser.add_argument('--report-formats', nargs='+', default=[], choices=REPORT_FORMATS,
+                        help='Also write the report as result.jsonl and/or result.parquet (parquet requires pyarrow)')
+    parser.add_argument('--queue', type=str, default=None,
+                        help='SQLite file of a work queue shared with --worker processes: the DOIs or Scholar results of the query are added to it, and the report is written in --dwn-dir once the workers have processed them')
+    parser.add_argument('--worker', action='store_true', default=False,
+                        help='Process the items of --queue, downloading them in --dwn-dir, until none is left. Any number of workers can run on the same queue')
+    parser.add_argument('--bibtex-on-disk', action='store_true', default=False,
+                        help='Keep the BibTeX entries of the papers in a temporary file of --dwn-dir instead of memory, for runs over very many DOIs')
+    parser.add_argument('--no-version-check', action='store_true', default=False,
+                        help='Do not look for a newer version of PyPaperBot on PyPI (checked at most once a day)')
+    parser.add_argument('--progress', action='store_true', default=False,
+                        help='Show a live progress line with papers found and downloaded, traffic, retries and failures')
+    parser.add_argument('--html-parser', type=str, default='auto', choices=HTMLparsers.PARSER_BACKENDS,
+                        help='Backend used to parse Scholar and mirror pages, auto uses lxml when it is installed (default auto)')
     args = parser.parse_args()
 
     if args.single_proxy is not None:
@@ -127,7 +332,20 @@ def main():
         pchain = args.proxy
         proxy(pchain)
 
-    if args.query is None and args.doi_file is None and args.doi is None and args.cites is None:
+    version_check = None
+    if not args.no_version_check:
+        version_check = checkVersion(args.cache_dir.replace('\\', '/'))
+        if version_check is None:
+            versionNotice()
+
+    if args.worker:
+        if args.queue is None:
+            print("Error: --worker requires --queue")
+            sys.exit()
+        if args.query is not None or args.doi_file is not None or args.doi is not None or args.cites is not None:
+            print("Error: the papers of a --worker come from --queue, --query, --cites, --doi and --doi-file cannot be used")
+            sys.exit()
+    elif args.query is None and args.doi_file is None and args.doi is None and args.cites is None:
         print("Error, provide at least one of the following arguments: --query, --file, or --cites")
         sys.exit()
 
@@ -149,6 +367,38 @@ def main():
     if not os.path.exists(dwn_dir):
         os.makedirs(dwn_dir, exist_ok=True)
 
+    if not args.no_cache:
+        Cache.configure(args.cache_dir.replace('\\', '/'), args.cache_ttl * 86400, args.cache_max_entries)
+
+    if args.download_workers < 1 or args.max_per_host < 1 or args.crossref_workers < 1 or args.scholar_workers < 1:
+        print("Error: --download-workers, --max-per-host, --crossref-workers and --scholar-workers must be at least 1")
+        sys.exit()
+
+    if args.hedge_delay is not None and args.hedge_delay < 0:
+        print("Error: --hedge-delay cannot be negative")
+        sys.exit()
+
+    if not 0 < args.min_rate <= args.rate <= args.max_rate:
+        print("Error: rates must satisfy 0 < --min-rate <= --rate <= --max-rate")
+        sys.exit()
+    if "parquet" in args.report_formats:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("Error: --report-formats parquet requires pyarrow to be installed (pip install pyarrow)")
+            sys.exit()
+
+    try:
+        HTMLparsers.setParserBackend(args.html_parser)
+    except ImportError:
+        print("Error: --html-parser lxml requires lxml to be installed (pip install lxml)")
+        sys.exit()
+
+    NetInfo.RATE = args.rate
+    NetInfo.MIN_RATE = args.min_rate
+    NetInfo.MAX_RATE = args.max_rate
+    RateLimiter.resetLimiter()
+
     if args.max_dwn_year is not None and args.max_dwn_cites is not None:
         print("Error: Only one option between '--max-dwn-year' and '--max-dwn-cites' can be used ")
         sys.exit()
@@ -174,19 +424,30 @@ def main():
     else:
         scholar_pages = 0
 
+    shard = None
+    if args.shard is not None:
+        if args.doi_file is None:
+            print("Error: --shard can only be used with --doi-file")
+            sys.exit()
+        try:
+            shard = parseShard(args.shard)
+        except ValueError:
+            print("Error: Invalid format for --shard option. Expected: i/N with 1 <= i <= N, got: " + args.shard)
+            sys.exit()
+
+    # DOIs are read, normalized and deduplicated as the run consumes them
     DOIs = None
+    doi_source = None  # identifies the DOIs of the run in its journal
     if args.doi_file is not None:
-        DOIs = []
-        f = args.doi_file.replace('\\', '/')
-        with open(f) as file_in:
-            for line in file_in:
-                if line[-1] == '\n':
-                    DOIs.append(line[:-1])
-                else:
-                    DOIs.append(line)
+        doi_source = "file:" + os.path.abspath(args.doi_file) + ("#" + args.shard if args.shard is not None else "")
+        DOIs = uniqueDOIs(readDOIFile(args.doi_file.replace('\\', '/')), shard, dwn_dir)
 
     if args.doi is not None:
-        DOIs = [args.doi]
+        DOIs = list(uniqueDOIs([args.doi]))
+        if len(DOIs) == 0:
+            print("Error: {} is not a DOI".format(args.doi))
+            sys.exit()
+        doi_source = "doi:" + DOIs[0].lower()
 
     max_dwn = None
     max_dwn_type = None
@@ -198,12 +459,24 @@ def main():
         max_dwn_type = 1
 
 
+    if args.queue is not None:
+        if max_dwn is not None or args.resume or args.bibtex_on_disk:
+            # The papers of a queue are held by its SQLite file, a few at a time by each worker
+            print("Error: --max-dwn-year, --max-dwn-cites, --resume and --bibtex-on-disk cannot be used with --queue")
+            sys.exit()
+        runQueue(args, scholar_pages, DOIs, dwn_dir)
+        return
+
     start(args.query, args.scholar_results, scholar_pages, dwn_dir, proxy, args.min_year , max_dwn, max_dwn_type ,
           args.journal_filter, args.restrict, DOIs, args.scihub_mirror, args.selenium_chrome_version, args.cites,
-          args.use_doi_as_filename, args.annas_archive_mirror)
+          args.use_doi_as_filename, args.annas_archive_mirror, args.download_workers, args.max_per_host,
+          args.crossref_workers, args.hedge_delay, args.resume, args.library_dir, args.scholar_workers,
+          args.scholar_proxies, args.progress, args.report_formats, args.bibtex_on_disk, doi_source)
+
+    if version_check is not None and not version_check.is_alive():
+        versionNotice()
 
 if __name__ == "__main__":
-    checkVersion()
     main()
     print(
         """\nWork completed!
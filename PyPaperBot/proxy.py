@@ -1,7 +1,7 @@
 import socket
-import pyChainedProxy as socks
 
 def proxy(pchain):
+    import pyChainedProxy as socks
 
     chain = pchain
 
@@ -0,0 +1,328 @@
+"""
+End-to-end benchmark of a full PyPaperBot run without network access. Local HTTP stand-ins
+replace Google Scholar, the Crossref API (search, DOI lookups and BibTeX transform), the SciDB and
+SciHub landing pages and the server of the PDFs, each one with configurable latency, error rate
+and rate of 429 answers. __main__.start is run against them and the benchmark reports papers/s,
+time to first PDF, peak RSS of the run and the time spent in each stage as seen by the servers.
+
+    python benchmarks/bench_e2e.py --pages 3 --latency 0.05 --download-workers 4
+    python benchmarks/bench_e2e.py --dois 100 --error-rate 0.05 --throttle-rate 0.05 --json e2e.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SERVICES = ["scholar", "crossref", "scidb", "scihub", "files"]
+STAGES = ["scholar page", "crossref search", "crossref doi", "bibtex", "landing page", "pdf"]
+RESULTS_PER_PAGE = 10
+DOI_PREFIX = "10.5555/bench."
+
+WORDS = ["learning", "deep", "neural", "networks", "analysis", "graph", "robust", "efficient", "survey", "quantum",
+         "protein", "climate", "detection", "model", "optimization", "dynamics"]
+
+
+def paperTitle(n):
+    rnd = random.Random(n)
+    return "Offline benchmark paper {} on {}".format(n, " ".join(rnd.choice(WORDS) for _ in range(6)))
+
+
+def paperNumber(text):
+    match = re.search(r"(?:paper |bench\.|article/)(\d+)", unquote(text))
+    return int(match.group(1)) if match else None
+
+
+def crossrefItem(n):
+    return {"DOI": DOI_PREFIX + str(n), "title": [paperTitle(n)], "deposited": {"timestamp": 1600000000000 + n},
+            "short-container-title": ["J. Bench."], "author": [{"given": "Ada", "family": "Bench"}]}
+
+
+def scholarPage(start, base):
+    results = []
+    for n in range(start, start + RESULTS_PER_PAGE):
+        results.append(
+            '<div class="gs_r gs_or gs_scl"><div class="gs_ri"><h3 class="gs_rt"><a href="{base}/article/{n}">{title}'
+            '</a></h3><div class="gs_a">A Bench, B Offline&nbsp;- Journal of Benchmarks, {year} - bench.example</div>'
+            '<div class="gs_fl"><a href="/scholar?cites={n}">Cited by {cites}</a></div></div></div>'.format(
+                base=base, n=n, title=paperTitle(n), year=2000 + n % 24, cites=n % 500 + 1))
+    return '<!doctype html><html><head><title>Google Scholar</title></head><body><div id="gs_res_ccl_mid">{}</div>' \
+           '</body></html>'.format("".join(results))
+
+
+class Stats:
+    """Server side accounting of the requests of each stage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, status, size, begin, end):
+        with self.lock:
+            s = self.stages.setdefault(stage, {"requests": 0, "errors": 0, "throttled": 0, "bytes": 0, "busy": 0.0,
+                                               "first": begin, "last": end})
+            s["requests"] += 1
+            s["errors"] += status >= 500
+            s["throttled"] += status == 429
+            s["bytes"] += size
+            s["busy"] += end - begin
+            s["first"] = min(s["first"], begin)
+            s["last"] = max(s["last"], end)
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stages))
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)  # clients dropping a connection are expected
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        begin = time.time()
+        server = self.server
+        url = urlparse(self.path)
+        if url.path == "/_stats":
+            return self.reply(200, "application/json", json.dumps(server.stats.snapshot()).encode())
+
+        stage, content_type, body = self.route(url)
+        time.sleep(max(0.0, server.options["latency"] + random.uniform(-1, 1) * server.options["jitter"]))
+        with server.rnd_lock:
+            draw = server.rnd.random()
+        if body is None:
+            status, content_type, body = 404, "text/plain", b"not found"
+        elif draw < server.options["error_rate"]:
+            status, content_type, body = 500, "text/plain", b"stand-in failure"
+        elif draw < server.options["error_rate"] + server.options["throttle_rate"]:
+            status, content_type, body = 429, "text/plain", b"slow down"
+        else:
+            status = 200
+        self.reply(status, content_type, body)
+        server.stats.record(stage, status, len(body), begin, time.time())
+
+    def reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", str(self.server.options["retry_after"]))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, url):
+        service = self.server.service
+        bases = self.server.bases
+        n = paperNumber(url.path)
+        html = "text/html; charset=utf-8"
+
+        if service == "scholar":
+            start = int(parse_qs(url.query).get("start", ["0"])[0])
+            return "scholar page", html, scholarPage(start, bases["scholar"]).encode()
+
+        if service == "crossref":
+            query = parse_qs(url.query)
+            if url.path.endswith("/transform/application/x-bibtex"):
+                if n is None:
+                    return "bibtex", "text/plain", None
+                bibtex = "@article{{bench{n},\n title={{{title}}},\n author={{Bench, Ada and Offline, Bob}},\n " \
+                         "journal={{J. Bench.}},\n year={{{year}}},\n doi={{{doi}}}\n}}".format(
+                             n=n, title=paperTitle(n), year=2000 + n % 24, doi=DOI_PREFIX + str(n))
+                return "bibtex", "application/x-bibtex", bibtex.encode()
+            if url.path == "/works" and "query.bibliographic" in query:
+                n = paperNumber(query["query.bibliographic"][0])
+                rows = int(query.get("rows", ["20"])[0])
+                items = [crossrefItem(n)] if n is not None else []
+                items += [crossrefItem(1000000 + i) for i in range(min(rows, 20) - len(items))]
+                return "crossref search", "application/json", json.dumps({"message": {"items": items}}).encode()
+            if url.path == "/works" and "filter" in query:
+                numbers = [paperNumber(f) for f in query["filter"][0].split(",")]
+                items = [crossrefItem(n) for n in numbers if n is not None]
+                return "crossref doi", "application/json", json.dumps({"message": {"items": items}}).encode()
+            if url.path.startswith("/works/") and n is not None:
+                return "crossref doi", "application/json", json.dumps({"message": crossrefItem(n)}).encode()
+            return "crossref", "application/json", None
+
+        if service == "files":
+            if n is None:
+                return "pdf", "application/pdf", None
+            return "pdf", "application/pdf", self.server.pdf
+
+        pdf_link = "{}/pdf/bench.{}.pdf".format(bases["files"], n)
+        if n is None:
+            return "landing page", html, None
+        if service == "scidb":
+            page = '<html><body><ul><li><a href="{}">Download</a></li></ul></body></html>'.format(pdf_link)
+        else:
+            page = '<html><body><div id="article"><iframe id="pdf" src="{}"></iframe></div></body></html>'.format(
+                pdf_link)
+        return "landing page", html, page.encode()
+
+
+def runStandIns(options, ready, stop):
+    stats = Stats()
+    servers = {}
+    for i, service in enumerate(SERVICES):
+        server = StandInServer(("127.0.0.1", 0), StandInHandler)
+        server.service = service
+        server.options = options
+        server.stats = stats
+        server.rnd = random.Random(options["seed"] * 100 + i)
+        server.rnd_lock = threading.Lock()
+        server.pdf = b"%PDF-1.4\n" + b"0" * (options["pdf_kb"] * 1024 - 9)
+        servers[service] = server
+    bases = {service: "http://127.0.0.1:{}".format(server.server_address[1]) for service, server in servers.items()}
+    for server in servers.values():
+        server.bases = bases
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.put(bases)
+    stop.wait()
+
+
+def peakRSS():
+    try:
+        import resource
+    except ImportError:
+        return None  # not available on Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+# Time at which the first PDF appeared in dwn_dir, polled while the run goes on
+def watchFirstPDF(dwn_dir, done, found):
+    while not done.is_set():
+        if any(f.endswith(".pdf") for f in os.listdir(dwn_dir)):
+            found.append(time.time())
+            return
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=3, help="Scholar pages of the query (10 papers each)")
+    parser.add_argument("--dois", type=int, default=None, help="Download this many DOIs instead of a Scholar query")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each stand-in takes to answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of the 429 answers")
+    parser.add_argument("--pdf-kb", type=int, default=256, help="Size of each PDF")
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--max-per-host", type=int, default=2)
+    parser.add_argument("--crossref-workers", type=int, default=4)
+    parser.add_argument("--scholar-workers", type=int, default=1)
+    parser.add_argument("--hedge-delay", type=float, default=None)
+    parser.add_argument("--rate", type=float, default=None, help="Starting requests/s per host (default as the CLI)")
+    parser.add_argument("--max-rate", type=float, default=None, help="Maximum requests/s per host (default as the CLI)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=str, default=None, help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of PyPaperBot")
+    args = parser.parse_args()
+
+    from PyPaperBot.__main__ import start
+    from PyPaperBot.NetInfo import NetInfo
+    from PyPaperBot import HTTPClient, RateLimiter
+
+    options = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+               "throttle_rate": args.throttle_rate, "retry_after": args.retry_after, "pdf_kb": args.pdf_kb,
+               "seed": args.seed}
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    stop = context.Event()
+    stand_ins = context.Process(target=runStandIns, args=(options, ready, stop), daemon=True)
+    stand_ins.start()
+    bases = ready.get(timeout=30)
+
+    NetInfo.Scholar_URL = bases["scholar"] + "/scholar"
+    NetInfo.Crossref_URL = bases["crossref"]
+    if args.rate is not None:
+        NetInfo.RATE = args.rate
+    if args.max_rate is not None:
+        NetInfo.MAX_RATE = args.max_rate
+    NetInfo.MAX_RATE = max(NetInfo.MAX_RATE, NetInfo.RATE)
+    RateLimiter.resetLimiter()
+    HTTPClient.resetSession()
+
+    dwn_dir = tempfile.mkdtemp(prefix="pypaperbot-bench-") + "/"
+    DOIs = [DOI_PREFIX + str(n) for n in range(args.dois)] if args.dois is not None else None
+    done = threading.Event()
+    first_pdf = []
+    watcher = threading.Thread(target=watchFirstPDF, args=(dwn_dir, done, first_pdf), daemon=True)
+
+    out = sys.stdout if args.verbose else open(os.devnull, "w")
+    begin = time.time()
+    watcher.start()
+    try:
+        with contextlib.redirect_stdout(out):
+            start("offline benchmark", RESULTS_PER_PAGE, range(1, args.pages + 1), dwn_dir, None, DOIs=DOIs,
+                  SciHub_URL=bases["scihub"] + "/", SciDB_URL=bases["scidb"] + "/scidb/",
+                  download_workers=args.download_workers, max_per_host=args.max_per_host,
+                  crossref_workers=args.crossref_workers, hedge_delay=args.hedge_delay,
+                  scholar_workers=args.scholar_workers)
+        wall = time.time() - begin
+    finally:
+        done.set()
+        stats = json.loads(HTTPClient.get(bases["scholar"] + "/_stats").text)
+        stop.set()
+        stand_ins.join(5)
+
+    papers = len(DOIs) if DOIs is not None else args.pages * RESULTS_PER_PAGE
+    downloaded = sum(1 for f in os.listdir(dwn_dir) if f.endswith(".pdf"))
+    shutil.rmtree(dwn_dir, ignore_errors=True)
+    rss = peakRSS()
+    results = {
+        "papers": papers,
+        "downloaded": downloaded,
+        "seconds": wall,
+        "papers_per_second": downloaded / wall,
+        "time_to_first_pdf": first_pdf[0] - begin if first_pdf else None,
+        "peak_rss_bytes": rss,
+        "stages": {},
+    }
+    for stage in STAGES:
+        if stage in stats:
+            s = stats[stage]
+            results["stages"][stage] = {"requests": s["requests"], "errors": s["errors"], "throttled": s["throttled"],
+                                        "bytes": s["bytes"], "busy_seconds": s["busy"],
+                                        "span_seconds": s["last"] - s["first"], "start_offset": s["first"] - begin}
+
+    print("papers: {}  downloaded: {}  time: {:.2f} s  papers/s: {:.2f}".format(
+        papers, downloaded, wall, results["papers_per_second"]))
+    print("time to first PDF: {}".format(
+        "{:.2f} s".format(results["time_to_first_pdf"]) if first_pdf else "no PDF downloaded"))
+    if rss is not None:
+        print("peak RSS: {:.1f} MB".format(rss / 2 ** 20))
+    print("\n{:<16} {:>8} {:>7} {:>6} {:>10} {:>9} {:>9} {:>9}".format(
+        "stage", "requests", "errors", "429s", "MB", "busy s", "from s", "span s"))
+    for stage, s in results["stages"].items():
+        print("{:<16} {:>8} {:>7} {:>6} {:>10.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            stage, s["requests"], s["errors"], s["throttled"], s["bytes"] / 2 ** 20, s["busy_seconds"],
+            s["start_offset"], s["span_seconds"]))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Parse throughput of HTMLparsers on the saved pages in benchmarks/fixtures, for each available
+parser backend (the PDF link extractor does not build a soup and is measured once), compared with
+the previous full html.parser tree and repeated findAll scans.
+The benchmark fails if any backend extracts something different from the previous parsers.
+
+    python benchmarks/bench_html_parsers.py --repeat 200
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bs4 import BeautifulSoup
+from PyPaperBot import HTMLparsers
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+PAGES = {
+    "schoolarParser": ["scholar_results.html"],
+    "getSchiHubPDF": ["scihub_iframe.html", "scihub_embed.html", "scidb.html"],
+    "SciHubUrls": ["scihub_mirrors.html"],
+}
+
+
+def legacySchoolarParser(html):
+    result = []
+    soup = BeautifulSoup(html, "html.parser")
+    for element in soup.find_all("div", class_="gs_r gs_or gs_scl"):
+        if not HTMLparsers.isBook(element):
+            title = link = link_pdf = cites = year = authors = None
+            for h3 in element.find_all("h3", class_="gs_rt"):
+                found = False
+                for a in h3.find_all("a"):
+                    if not found:
+                        title = a.text
+                        link = a.get("href")
+                        found = True
+            for a in element.find_all("a"):
+                if "Cited by" in a.text:
+                    cites = int(a.text[8:])
+                if "[PDF]" in a.text:
+                    link_pdf = a.get("href")
+            for div in element.find_all("div", class_="gs_a"):
+                try:
+                    authors, source_and_year, source = div.text.replace('\u00A0', ' ').split(" - ")
+                except ValueError:
+                    continue
+                authors = authors.replace(', ', ';') if not authors.strip().endswith('\u2026') else None
+                try:
+                    year = int(source_and_year[-4:])
+                except ValueError:
+                    continue
+                year = str(year) if 1000 <= year <= 3000 else None
+            if title is not None:
+                result.append({'title': title, 'link': link, 'cites': cites, 'link_pdf': link_pdf, 'year': year,
+                               'authors': authors})
+    return result
+
+
+def legacyGetSchiHubPDF(html):
+    soup = BeautifulSoup(html, "html.parser")
+    iframe = soup.find(id='pdf')
+    plugin = soup.find(id='plugin')
+    download_scidb = soup.find("a", string=lambda text: text and "Download" in text, href=re.compile(r"\.pdf$"))
+    embed_scihub = soup.find("embed")
+    result = iframe.get("src") if iframe is not None else None
+    if plugin is not None and result is None:
+        result = plugin.get("src")
+    if result is not None and result[0] != "h":
+        result = "https:" + result
+    if download_scidb is not None and result is None:
+        result = download_scidb.get("href")
+    if embed_scihub is not None and result is None:
+        result = embed_scihub.get("original-url")
+    return result
+
+
+def legacySciHubUrls(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [a.get("href") for ul in soup.find_all("ul") for a in ul.find_all("a")
+            if a.get("href").startswith("https://sci-hub.") or a.get("href").startswith("http://sci-hub.")]
+
+
+# Parsers not building a soup, measured once
+SINGLE_PASS = {"getSchiHubPDF"}
+
+LEGACY = {
+    "schoolarParser": legacySchoolarParser,
+    "getSchiHubPDF": legacyGetSchiHubPDF,
+    "SciHubUrls": legacySciHubUrls,
+}
+
+
+def availableBackends():
+    backends = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+        backends.append("lxml")
+    except ImportError:
+        print("lxml is not installed, only the html.parser backend is measured")
+    return backends
+
+
+def measure(function, pages, repeat):
+    t = time.perf_counter()
+    for _ in range(repeat):
+        for html in pages:
+            function(html)
+    return (time.perf_counter() - t) / (repeat * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = {}
+    for name, files in PAGES.items():
+        pages[name] = []
+        for file in files:
+            with open(os.path.join(FIXTURES, file), encoding="utf-8") as f:
+                pages[name].append(f.read())
+
+    identical = True
+    for name in PAGES:
+        expected = [LEGACY[name](html) for html in pages[name]]
+        legacy_time = measure(LEGACY[name], pages[name], args.repeat)
+        print("{}: {} pages, {} bytes".format(name, len(pages[name]), sum(map(len, pages[name]))))
+        print("  {:<14} {:8.3f} ms/page".format("previous", legacy_time * 1e3))
+        for backend in ["single pass"] if name in SINGLE_PASS else availableBackends():
+            if name not in SINGLE_PASS:
+                HTMLparsers.setParserBackend(backend)
+            function = getattr(HTMLparsers, name)
+            same = [function(html) for html in pages[name]] == expected
+            identical = identical and same
+            backend_time = measure(function, pages[name], args.repeat)
+            print("  {:<14} {:8.3f} ms/page  speedup: {:.1f}x  identical: {}".format(
+                backend, backend_time * 1e3, legacy_time / backend_time, same))
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
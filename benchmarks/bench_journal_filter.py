@@ -0,0 +1,122 @@
+"""
+Benchmark of PapersFilters.filterJurnals against the previous implementation, which compared
+every paper with every csv row through SequenceMatcher.
+
+    python benchmarks/bench_journal_filter.py --journals 30000 --papers 2000
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyPaperBot.Paper import Paper
+from PyPaperBot.PapersFilters import filterJurnals
+from PyPaperBot import JournalIndex
+
+WORDS = ["journal", "international", "review", "letters", "applied", "physics", "chemistry", "biology", "medicine",
+         "research", "engineering", "computer", "science", "advances", "annals", "transactions", "systems", "studies",
+         "clinical", "molecular", "quarterly", "european", "american", "society", "materials", "energy", "neural",
+         "networks", "statistics", "mathematics", "economics", "psychology", "ecology", "environmental", "acta"]
+
+
+def legacyFilterJurnals(papers, csv_path):
+    result = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f, delimiter=";"))
+    journal_list = [row["journal_list"] for row in rows]
+    include_list = [int(row["include_list"]) for row in rows]
+
+    for p in papers:
+        good = not (p.jurnal is not None and len(p.jurnal) > 0)
+        if p.jurnal is not None:
+            for jurnal, include in zip(journal_list, include_list):
+                if include == 1 and SequenceMatcher(None, p.jurnal, jurnal).ratio() >= 0.8:
+                    good = True
+
+        if good:
+            result.append(p)
+
+    return result
+
+
+def typo(name, rnd):
+    chars = list(name)
+    for _ in range(rnd.randint(1, 3)):
+        i = rnd.randrange(len(chars))
+        chars[i] = rnd.choice("abcdefghijklmnopqrstuvwxyz ")
+    return "".join(chars)
+
+
+def makeData(n_journals, n_papers, seed):
+    rnd = random.Random(seed)
+    journals = [" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 6))).title() + " " + str(i)
+                for i in range(n_journals)]
+    papers = []
+    for i in range(n_papers):
+        kind = rnd.random()
+        p = Paper("Paper {}".format(i))
+        if kind < 0.3:
+            p.jurnal = rnd.choice(journals)
+        elif kind < 0.6:
+            p.jurnal = typo(rnd.choice(journals), rnd)
+        elif kind < 0.95:
+            p.jurnal = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 6))).title()
+        papers.append(p)
+    return journals, papers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--journals", type=int, default=30000)
+    parser.add_argument("--papers", type=int, default=2000)
+    parser.add_argument("--legacy-papers", type=int, default=100,
+                        help="Papers checked with the previous implementation (it is very slow)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    journals, papers = makeData(args.journals, args.papers, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "journals.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("journal_list;include_list\n")
+            for i, jurnal in enumerate(journals):
+                f.write("{};{}\n".format(jurnal, 0 if i % 10 == 0 else 1))
+
+        t = time.perf_counter()
+        JournalIndex.loadJournalIndex(csv_path, tmp)
+        build = time.perf_counter() - t
+        JournalIndex._loaded.clear()
+        t = time.perf_counter()
+        JournalIndex.loadJournalIndex(csv_path, tmp)
+        load = time.perf_counter() - t
+
+        t = time.perf_counter()
+        result = filterJurnals(papers, csv_path)
+        indexed = time.perf_counter() - t
+
+        sample = papers[:args.legacy_papers]
+        t = time.perf_counter()
+        legacy = legacyFilterJurnals(sample, csv_path)
+        legacy_time = time.perf_counter() - t
+
+    indexed_sample = [p for p in result if p in set(sample)]
+    same = [p.title for p in indexed_sample] == [p.title for p in legacy]
+    per_paper_indexed = indexed / len(papers)
+    per_paper_legacy = legacy_time / len(sample)
+    print("journals: {}  papers: {}  kept: {}".format(len(journals), len(papers), len(result)))
+    print("index build: {:.3f}s  index load from disk: {:.3f}s".format(build, load))
+    print("indexed filter: {:.3f} ms/paper".format(per_paper_indexed * 1000))
+    print("legacy filter:  {:.3f} ms/paper ({} papers)".format(per_paper_legacy * 1000, len(sample)))
+    print("speedup: {:.0f}x  same result on sample: {}".format(per_paper_legacy / per_paper_indexed, same))
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
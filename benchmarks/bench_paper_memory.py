@@ -0,0 +1,112 @@
+"""
+Memory held by the Paper objects of a run over many DOIs, as measured by tracemalloc: the slotted
+Paper with interned journal names and years, with and without the BibTeX entries kept on disk,
+compared with the previous attribute-dict Paper. The records have the fields set by a DOI lookup
+on Crossref and a BibTeX entry of a few hundred bytes.
+
+    python benchmarks/bench_paper_memory.py --records 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyPaperBot.Paper import Paper, BibtexStore
+
+WORDS = ["learning", "deep", "neural", "networks", "analysis", "model", "data", "approach", "system", "method",
+         "efficient", "graph", "optimization", "survey", "robust", "detection", "classification", "image",
+         "protein", "cancer", "clinical", "climate", "energy", "quantum", "dynamics"]
+JOURNALS = 2000  # distinct journal names
+
+
+class LegacyPaper:
+    """The previous Paper: an attribute dict holding the parsed fields and the raw BibTeX"""
+
+    def __init__(self, title=None, scholar_link=None, scholar_page=None, cites=None, link_pdf=None, year=None,
+                 authors=None):
+        self.title = title
+        self.scholar_page = scholar_page
+        self.scholar_link = scholar_link
+        self.pdf_link = link_pdf
+        self.year = year
+        self.authors = authors
+
+        self.jurnal = None
+        self.cites_num = None
+        self.bibtex = None
+        self.DOI = None
+
+        self.downloaded = False
+        self.downloadedFrom = 0
+
+        self.use_doi_as_filename = False
+
+
+# Fields of the n-th record, each one a new string object as if read from a Crossref answer
+def record(n, rnd):
+    title = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 12))).capitalize() + " " + str(n)
+    journal = "Journal of {} {}".format(WORDS[n % len(WORDS)], n % JOURNALS)
+    year = str(1990 + n % 35)
+    authors = " and ".join("{}, {}.".format(rnd.choice(WORDS).capitalize(), chr(65 + rnd.randrange(26)))
+                           for _ in range(rnd.randint(1, 5)))
+    DOI = "10.{}/bench.{}".format(1000 + n % 5000, n)
+    bibtex = "@article{{bench{},\n title={{{}}},\n author={{{}}},\n journal={{{}}},\n year={{{}}},\n doi={{{}}},\n " \
+             "publisher={{Offline Press}}\n}}".format(n, title, authors, journal, year, DOI)
+    return title, journal, year, authors, DOI, bibtex
+
+
+def build(paper_class, records, seed, store=None):
+    rnd = random.Random(seed)
+    papers = []
+    for n in range(records):
+        title, journal, year, authors, DOI, bibtex = record(n, rnd)
+        p = paper_class(title)
+        p.DOI = DOI
+        p.jurnal = journal
+        p.year = year
+        p.authors = authors
+        p.bibtex = bibtex  # parsed fields set above, as Paper would after reading them
+        if store is not None:
+            p.spillBibtex(store)
+        papers.append(p)
+    return papers
+
+
+def measure(label, paper_class, records, seed, store=None):
+    gc.collect()
+    tracemalloc.start()
+    t = time.perf_counter()
+    papers = build(paper_class, records, seed, store)
+    seconds = time.perf_counter() - t
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("  {:<24} {:8.1f} MB  {:6.0f} bytes/paper  built in {:5.1f} s".format(
+        label, current / 2 ** 20, current / records, seconds))
+    del papers
+    gc.collect()
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print("{} papers".format(args.records))
+    legacy = measure("previous", LegacyPaper, args.records, args.seed)
+    slotted = measure("slots", Paper, args.records, args.seed)
+    store = BibtexStore()
+    spilled = measure("slots + BibTeX on disk", Paper, args.records, args.seed, store)
+    print("  BibTeX file: {:.1f} MB".format(store.size / 2 ** 20))
+    store.close()
+    print("reduction: {:.1f}x in memory, {:.1f}x with BibTeX on disk".format(legacy / slotted, legacy / spilled))
+
+
+if __name__ == "__main__":
+    main()
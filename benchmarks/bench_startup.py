@@ -0,0 +1,77 @@
+"""
+Startup time of the PyPaperBot CLI: import of PyPaperBot.__main__ and `python -m PyPaperBot --help`,
+each one in a fresh interpreter, along with the heavy dependencies loaded by the import. The
+benchmark fails if one of them is imported eagerly. --compare REV also measures the package as it
+was at the git revision REV.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --compare HEAD~5
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Only needed by some code paths: Selenium, journal filter, BibTeX parsing, proxies, reports
+HEAVY_MODULES = ["pandas", "selenium", "undetected_chromedriver", "numpy", "bibtexparser", "crossref_commons",
+                 "pyChainedProxy", "pyarrow"]
+
+LOADED = "import sys, PyPaperBot.__main__; print(' '.join(m for m in {} if m in sys.modules))".format(HEAVY_MODULES)
+
+
+def timeRuns(command, root, runs):
+    env = dict(os.environ, PYTHONPATH=root)
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        subprocess.run(command, cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def measure(label, root, runs):
+    env = dict(os.environ, PYTHONPATH=root)
+    subprocess.run([sys.executable, "-c", "import PyPaperBot.__main__"], cwd=root, env=env, check=True)  # warm up
+    imported = timeRuns([sys.executable, "-c", "import PyPaperBot.__main__"], root, runs)
+    cli = timeRuns([sys.executable, "-m", "PyPaperBot", "--help"], root, runs)
+    loaded = subprocess.run([sys.executable, "-c", LOADED], cwd=root, env=env, capture_output=True, text=True,
+                            check=True).stdout.split()
+
+    print(label)
+    print("  import PyPaperBot.__main__  median {:7.1f} ms  min {:7.1f} ms".format(
+        statistics.median(imported) * 1e3, min(imported) * 1e3))
+    print("  python -m PyPaperBot --help median {:7.1f} ms  min {:7.1f} ms".format(
+        statistics.median(cli) * 1e3, min(cli) * 1e3))
+    print("  heavy modules imported: {}".format(", ".join(loaded) if loaded else "none"))
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--compare", type=str, default=None, help="Git revision to compare with")
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        old_root = tempfile.mkdtemp(prefix="pypaperbot-startup-")
+        try:
+            archive = subprocess.run(["git", "archive", args.compare, "PyPaperBot"], cwd=ROOT, capture_output=True,
+                                     check=True).stdout
+            subprocess.run(["tar", "-x", "-C", old_root], input=archive, check=True)
+            measure(args.compare, old_root, args.runs)
+        finally:
+            shutil.rmtree(old_root, ignore_errors=True)
+
+    loaded = measure("working tree", ROOT, args.runs)
+    if loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
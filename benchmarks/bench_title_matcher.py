@@ -0,0 +1,75 @@
+"""
+Microbenchmark of the Crossref candidate title matching: TitleMatcher against the previous
+similarStrings(title.lower(), candidate.lower()) > 0.75 check on every candidate.
+
+    python benchmarks/bench_title_matcher.py --titles 500 --candidates 30
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyPaperBot.PapersFilters import similarStrings
+from PyPaperBot.TitleMatcher import TitleMatcher
+
+WORDS = ["learning", "deep", "neural", "networks", "analysis", "model", "models", "data", "approach", "based",
+         "system", "systems", "method", "novel", "efficient", "graph", "optimization", "survey", "towards", "robust",
+         "detection", "using", "for", "of", "the", "and", "in", "with", "a", "on", "classification", "image",
+         "protein", "cancer", "clinical", "study", "effects", "climate", "energy", "quantum", "dynamics"]
+
+
+def randomTitle(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 14))).capitalize()
+
+
+def variant(title, rnd):
+    words = title.split()
+    for _ in range(rnd.randint(0, 2)):
+        words[rnd.randrange(len(words))] = rnd.choice(WORDS)
+    return " ".join(words).upper() if rnd.random() < 0.2 else " ".join(words)
+
+
+def makeData(n_titles, n_candidates, seed):
+    rnd = random.Random(seed)
+    data = []
+    for _ in range(n_titles):
+        title = randomTitle(rnd)
+        candidates = [randomTitle(rnd) for _ in range(n_candidates)]
+        for i in rnd.sample(range(n_candidates), rnd.randint(0, 2)):
+            candidates[i] = variant(title, rnd)
+        data.append((title, candidates))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--titles", type=int, default=500)
+    parser.add_argument("--candidates", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    data = makeData(args.titles, args.candidates, args.seed)
+
+    t = time.perf_counter()
+    legacy = [[similarStrings(title.lower(), c.lower()) > 0.75 for c in candidates] for title, candidates in data]
+    legacy_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    matched = [[r is not None for r in TitleMatcher(title).scoreAll(candidates)] for title, candidates in data]
+    matcher_time = time.perf_counter() - t
+
+    comparisons = args.titles * args.candidates
+    print("titles: {}  candidates per title: {}  matches: {}".format(args.titles, args.candidates,
+                                                                      sum(map(sum, matched))))
+    print("similarStrings: {:.2f} us/candidate".format(legacy_time / comparisons * 1e6))
+    print("TitleMatcher:   {:.2f} us/candidate".format(matcher_time / comparisons * 1e6))
+    print("speedup: {:.1f}x  identical decisions: {}".format(legacy_time / matcher_time, legacy == matched))
+    if legacy != matched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,6 @@ setuptools.setup(
         'certifi>=2020.6.20',
         'chardet>=3.0.4',
         'colorama>=0.4.3',
-        'crossref-commons>=0.0.7',
         'future>=0.18.2',
         'HTMLParser>=0.0.2',
         'idna>=2.10,<3',
@@ -31,7 +30,6 @@ setuptools.setup(
         'lazy-object-proxy>=1.4.3',
         'mccabe>=0.6.1',
         'numpy',
-        'pandas',
         'pyChainedProxy>=1.1',
         'pylint>=2.6.0',
         'pyparsing>=2.4.7',
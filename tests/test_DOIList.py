@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from PyPaperBot.DOIList import normalizeDOI, digestDOI, parseShard, inShard, uniqueDOIs
+
+
+@pytest.mark.parametrize("line", [
+    "10.1000/xyz.123",
+    "  10.1000/xyz.123\n",
+    "https://doi.org/10.1000/xyz.123",
+    "http://dx.doi.org/10.1000/xyz.123",
+    "doi.org/10.1000/xyz.123",
+    "https://doi.org/10.1000%2Fxyz.123",
+    "doi:10.1000/xyz.123",
+    "doi: 10.1000/xyz.123",
+    "HTTPS://DOI.ORG/10.1000/xyz.123",
+    "DOI:10.1000/xyz.123",
+])
+def test_prefixes_are_removed(line):
+    assert normalizeDOI(line) == "10.1000/xyz.123"
+
+
+@pytest.mark.parametrize("line", ["", "xyz.123", "10.1000", "11.1000/xyz", "https://example.org/10.1000/xyz",
+                                  "doi:", "isbn:10.1000/xyz"])
+def test_lines_that_are_not_dois_are_rejected(line):
+    assert normalizeDOI(line) is None
+
+
+def test_case_is_kept_but_folded_for_deduplication():
+    assert normalizeDOI("doi:10.1000/ABC") == "10.1000/ABC"
+    assert digestDOI("10.1000/ABC") == digestDOI("10.1000/abc")
+    lines = ["10.1000/ABC", "https://doi.org/10.1000/abc", "doi:10.1000/Abc", "10.1000/other", "not a doi"]
+    assert list(uniqueDOIs(lines)) == ["10.1000/ABC", "10.1000/other"]
+
+
+@pytest.mark.parametrize("spec", ["0/4", "5/4", "-1/4", "a/b", "1", "1/", "/4", "1/2/3", "1/0"])
+def test_bad_shard_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parseShard(spec)
+
+
+def test_shard_spec():
+    assert parseShard("1/1") == (1, 1)
+    assert parseShard(" 3/4") == (3, 4)
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 7, 16])
+def test_every_doi_is_in_exactly_one_shard(n):
+    DOIs = ["10.{}/item.{}".format(1000 + k % 13, k) for k in range(2000)]
+    shards = [parseShard("{}/{}".format(i, n)) for i in range(1, n + 1)]
+    counts = [0] * n
+    for DOI in DOIs:
+        owners = [s for s in range(n) if inShard(digestDOI(DOI), shards[s])]
+        assert len(owners) == 1
+        counts[owners[0]] += 1
+    # every shard gets its share, so that workers have comparable loads
+    assert min(counts) > len(DOIs) / n / 2
+
+    kept = [list(uniqueDOIs(DOIs + [DOI.upper() for DOI in DOIs], shard)) for shard in shards]
+    assert sorted(sum(kept, [])) == sorted(DOIs)
+    assert inShard(digestDOI(DOIs[0]), None)
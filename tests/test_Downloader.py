@@ -0,0 +1,189 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+pytest.importorskip("requests")
+
+from PyPaperBot import Downloader  # noqa: E402
+from PyPaperBot.Downloader import (downloadPapers, downloadPaperHedged, fetchPDF, partialFile, saveFile,  # noqa: E402
+                                   HostLimiter, Cancelled)
+from PyPaperBot.Library import Library, linkFile  # noqa: E402
+from PyPaperBot.Paper import Paper  # noqa: E402
+
+
+class Mirrors:
+    def current(self):
+        return "http://scihub.invalid/"
+
+    def record(self, url, ok):
+        pass
+
+
+# fetchPDF stand-in writing a complete partial file for every source
+def fetchAll(url, dwnl_dir, limiter, landing_page, cancel=None, source=None, keep_partial=True):
+    part_file = partialFile(dwnl_dir, url)
+    with open(part_file, "wb") as f:
+        f.write(b"%PDF-1.4 " + url.encode())
+    return part_file
+
+
+PDF = b"%PDF-1.4 " + bytes(range(256)) * 64
+
+
+class PDFHandler(BaseHTTPRequestHandler):
+    """Serves PDF, honoring Range requests as the server's range_mode says: "honor", "ignore" (full 200) or "wrong"
+    (206 starting elsewhere)"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        self.server.ranges.append(requested)
+        start = int(requested[len("bytes="):-1]) if requested is not None else None
+        if start is None or self.server.range_mode == "ignore":
+            self.reply(200, PDF)
+        else:
+            if self.server.range_mode == "wrong":
+                start = 0
+            self.reply(206, PDF[start:], "bytes {}-{}/{}".format(start, len(PDF) - 1, len(PDF)))
+
+    def reply(self, status, body, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        if content_range is not None:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def pdf_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PDFHandler)
+    server.daemon_threads = True
+    server.range_mode = "honor"
+    server.ranges = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def papers(*titles):
+    result = []
+    for n, title in enumerate(titles):
+        p = Paper(title)
+        p.DOI = "10.1/{}".format(n)
+        result.append(p)
+    return result
+
+
+def test_a_pdf_that_cannot_be_saved_fails_only_its_paper(tmp_path, monkeypatch):
+    monkeypatch.setattr(Downloader, "fetchPDF", fetchAll)
+    to_download = papers("x" * 300, "short", "short")
+
+    assert downloadPapers(to_download, str(tmp_path), None, max_workers=2, mirrors=Mirrors()) == 2
+    assert [p.downloaded for p in to_download] == [False, True, True]
+    assert sorted(os.listdir(str(tmp_path))) == ["(2)short.pdf", "short.pdf"]
+
+
+def test_a_failed_save_frees_its_file_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(Downloader, "fetchPDF", fetchAll)
+    failures = [OSError("disk full")]
+
+    def saveOnce(file_name, part_file, paper, dwn_source):
+        if failures:
+            raise failures.pop()
+        saveFile(file_name, part_file, paper, dwn_source)
+    monkeypatch.setattr(Downloader, "saveFile", saveOnce)
+    to_download = papers("same", "same")
+
+    assert downloadPapers(to_download, str(tmp_path), None, mirrors=Mirrors()) == 1
+    assert os.listdir(str(tmp_path)) == ["same.pdf"]
+
+
+def test_a_library_pdf_that_cannot_be_linked_fails_only_its_paper(tmp_path, monkeypatch):
+    monkeypatch.setattr(Downloader, "fetchPDF", fetchAll)
+    library = Library(str(tmp_path / "library"))
+    held = fetchAll("http://pdf.invalid/held.pdf", str(tmp_path), None, False)
+    library.add(held, "10.1/0", 1)
+
+    def linkNotHeld(src, dst):
+        if os.path.basename(dst) == "held.pdf":
+            raise OSError("cross-device link")
+        linkFile(src, dst)
+    monkeypatch.setattr(Downloader, "linkFile", linkNotHeld)
+    to_download = papers("held", "fresh")
+    dwnl_dir = tmp_path / "out"
+    dwnl_dir.mkdir()
+
+    try:
+        assert downloadPapers(to_download, str(dwnl_dir), None, mirrors=Mirrors(), library=library) == 1
+    finally:
+        library.close()
+    assert [p.downloaded for p in to_download] == [False, True]
+    assert os.listdir(str(dwnl_dir)) == ["fresh.pdf"]
+
+
+def test_hedged_download_keeps_no_partial_file_of_the_losers(tmp_path, monkeypatch):
+    monkeypatch.setattr(Downloader, "fetchPDF", fetchAll)
+    p, = papers("hedged")
+    p.scholar_link = "http://scholar.invalid/hedged.pdf"  # three sources, all delivering a PDF
+
+    assert downloadPaperHedged(p, str(tmp_path), HostLimiter(2), Mirrors(), 0) == "hedged.pdf"
+    assert os.listdir(str(tmp_path)) == ["hedged.pdf"]
+
+
+def test_hedged_download_that_cannot_be_saved_fails_only_its_paper(tmp_path, monkeypatch):
+    monkeypatch.setattr(Downloader, "fetchPDF", fetchAll)
+    p, = papers("x" * 300)
+
+    assert downloadPaperHedged(p, str(tmp_path), HostLimiter(2), Mirrors(), 0) is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize("keep_partial", [True, False])
+def test_cancelled_fetch_keeps_its_partial_file_only_if_asked(tmp_path, keep_partial):
+    url = "http://pdf.invalid/a.pdf"
+    part_file = partialFile(str(tmp_path), url)
+    with open(part_file, "wb") as f:
+        f.write(b"%PDF-1.4 half")
+    cancel = threading.Event()
+    cancel.set()
+
+    with pytest.raises(Cancelled):
+        fetchPDF(url, str(tmp_path), HostLimiter(2), False, cancel, keep_partial=keep_partial)
+    assert os.path.exists(part_file) == keep_partial
+
+
+@pytest.mark.parametrize("range_mode", ["honor", "ignore", "wrong"])
+def test_partial_file_is_resumed_or_fetched_again(tmp_path, pdf_server, range_mode):
+    pdf_server.range_mode = range_mode
+    url = "http://127.0.0.1:{}/a.pdf".format(pdf_server.server_address[1])
+    part_file = partialFile(str(tmp_path), url)
+    with open(part_file, "wb") as f:
+        f.write(PDF[:1000])
+
+    assert fetchPDF(url, str(tmp_path), HostLimiter(2), False) == part_file
+    with open(part_file, "rb") as f:
+        assert f.read() == PDF  # a full answer to the Range request replaces the partial file, never appended to it
+    assert pdf_server.ranges[0] == "bytes=1000-"
+    # a 206 that does not start at the offset is dropped and the file requested again without Range
+    assert pdf_server.ranges[1:] == ([None] if range_mode == "wrong" else [])
+
+
+def test_fetch_without_partial_file_asks_for_the_whole_file(tmp_path, pdf_server):
+    url = "http://127.0.0.1:{}/a.pdf".format(pdf_server.server_address[1])
+
+    assert fetchPDF(url, str(tmp_path), HostLimiter(2), False) == partialFile(str(tmp_path), url)
+    with open(partialFile(str(tmp_path), url), "rb") as f:
+        assert f.read() == PDF
+    assert pdf_server.ranges == [None]
@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyPaperBot.JobJournal import JobJournal, loadJournal, runHeader
+from PyPaperBot.Paper import Paper
+
+
+def test_header_is_written_once_and_loaded(tmp_path):
+    header = runHeader("deep learning", None, 2020, 10, None)
+    journal = JobJournal(str(tmp_path), header=header)
+    journal.pageResolved(1, [Paper("A")])
+    journal.close()
+
+    # Resuming appends to the journal without a second header
+    journal = JobJournal(str(tmp_path), resume=True, header=runHeader("other query"))
+    journal.pageResolved(2, [Paper("B")])
+    journal.close()
+
+    state = loadJournal(str(tmp_path))
+    assert state.header == header
+    assert sorted(state.pages) == [1, 2]
+
+
+def test_journal_without_header_has_none(tmp_path):
+    journal = JobJournal(str(tmp_path))
+    journal.doiResolved("10.1/a", Paper("A"))
+    journal.close()
+    assert loadJournal(str(tmp_path)).header is None
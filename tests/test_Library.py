@@ -0,0 +1,57 @@
+import os
+import stat
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from PyPaperBot import Library as LibraryModule
+from PyPaperBot.Library import Library, fileHash, sameContent
+from PyPaperBot.Paper import Paper
+
+
+def download(directory, content, name="part.pdf"):
+    file_name = os.path.join(directory, name)
+    with open(file_name, "wb") as f:
+        f.write(content)
+    return file_name
+
+
+def test_stored_objects_are_read_only(tmp_path):
+    library = Library(str(tmp_path / "library"))
+    object_path = library.add(download(str(tmp_path), b"%PDF-1 a"), "10.1/A", 1)
+    library.close()
+    assert not os.stat(object_path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    assert os.path.basename(object_path) == fileHash(object_path) + ".pdf"
+
+
+def test_same_content_of_a_copy(tmp_path):
+    library = Library(str(tmp_path / "library"))
+    object_path = library.add(download(str(tmp_path), b"%PDF-1 a"), "10.1/A", 1)
+    library.close()
+    assert sameContent(download(str(tmp_path), b"%PDF-1 a", "copy.pdf"), object_path)
+    assert not sameContent(download(str(tmp_path), b"%PDF-1 b", "other.pdf"), object_path)
+
+
+@pytest.mark.parametrize("hardlinks", [True, False])
+def test_linked_again_reuses_the_file(tmp_path, monkeypatch, hardlinks):
+    pytest.importorskip("requests")
+    from PyPaperBot.Downloader import linkPDF
+
+    if not hardlinks:
+        def noLink(src, dst):
+            raise OSError("cross-device link")
+        monkeypatch.setattr(LibraryModule.os, "link", noLink)
+
+    out = tmp_path / "out"
+    out.mkdir()
+    library = Library(str(tmp_path / "library"))
+    object_path = library.add(download(str(tmp_path), b"%PDF-1 a"), "10.1/A", 1)
+    p = Paper("A paper")
+    for _ in range(3):
+        assert linkPDF(p, str(out), object_path, 1) == p.getFileName()
+    library.close()
+    assert os.listdir(str(out)) == [p.getFileName()]
+    # A copy can be edited without touching the stored object
+    assert os.path.samefile(str(out / p.getFileName()), object_path) == hardlinks
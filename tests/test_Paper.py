@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from PyPaperBot.Paper import Paper, BibtexStore, spillBibtex
+
+ENTRY = "@article{a,\n title={A},\n author={Doe, J.},\n journal={Journal of Tests},\n year={2020}\n}"
+
+
+def test_spilled_entries_are_read_from_their_store(tmp_path):
+    store = BibtexStore(str(tmp_path))
+    p = Paper("A")
+    p.setBibtex(ENTRY)
+    spilled, = spillBibtex([p], store)
+    assert type(spilled._bibtex) is int
+    assert spilled.bibtex == ENTRY
+
+    # Entries set later go to the store of the paper, those of other papers stay in memory
+    spilled.bibtex = ENTRY.replace("2020", "2021")
+    other = Paper("B")
+    other.bibtex = ENTRY
+    assert type(spilled._bibtex) is int and spilled.bibtex.endswith("year={2021}\n}")
+    assert other._bibtex == ENTRY
+    store.close()
+
+
+def test_spilled_entries_are_parsed(tmp_path):
+    pytest.importorskip("bibtexparser")
+    store = BibtexStore(str(tmp_path))
+    p = Paper("A", year="1999", authors="Scholar, A.")
+    p.setBibtex(ENTRY)
+    p.spillBibtex(store)
+    assert (p.year, p.authors, p.jurnal) == ("2020", "Doe, J.", "Journal of Tests")
+    store.close()
+
+
+def test_stores_are_independent(tmp_path):
+    first, second = BibtexStore(str(tmp_path)), BibtexStore(str(tmp_path))
+    a, b = Paper("A"), Paper("B")
+    a.bibtex, b.bibtex = ENTRY, ENTRY.replace("{A}", "{B}")
+    a.spillBibtex(first)
+    b.spillBibtex(second)
+    first.close()
+    assert b.bibtex == ENTRY.replace("{A}", "{B}")
+    second.close()
+
+
+def test_round_trip_keeps_fields(tmp_path):
+    store = BibtexStore(str(tmp_path))
+    p = Paper("A", "https://scholar/a", 1)
+    p.DOI = "10.1/a"
+    p.setBibtex(ENTRY)
+    p.spillBibtex(store)
+    copy = Paper.fromDict(p.toDict())
+    assert copy.bibtex == ENTRY and copy._bibtex_store is None
+    store.close()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyPaperBot.Paper import Paper
+from PyPaperBot.Reports import OrderedReport
+
+
+class ListReport:
+    def __init__(self):
+        self.titles = []
+        self.closed = False
+
+    def write(self, p):
+        self.titles.append(p.title)
+
+    def close(self):
+        self.closed = True
+
+
+def test_papers_are_written_in_the_order_they_were_numbered():
+    written = ListReport()
+    report = OrderedReport(written)
+    papers = list(report.number(Paper(str(n)) for n in range(5)))
+
+    for n in (2, 0, 4):
+        report.write(papers[n])
+    assert written.titles == ["0"]  # 2 and 4 wait for 1 and 3
+    report.write(papers[1])
+    assert written.titles == ["0", "1", "2"]
+    report.write(papers[3])
+    assert written.titles == ["0", "1", "2", "3", "4"]
+    report.close()
+    assert written.closed
+
+
+def test_close_writes_the_papers_left_behind_an_unfinished_one():
+    written = ListReport()
+    report = OrderedReport(written)
+    papers = list(report.number(Paper(str(n)) for n in range(4)))
+    report.write(papers[3])
+    report.write(papers[1])
+    report.close()
+    assert written.titles == ["1", "3"]
@@ -0,0 +1,132 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from PyPaperBot import WorkQueue as WorkQueueModule
+from PyPaperBot.WorkQueue import WorkQueue, MAX_ATTEMPTS, CLAIM_SIZES
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = WorkQueue(str(tmp_path / "work.sqlite"))
+    yield q
+    q.close()
+
+
+def test_enqueue_ignores_items_already_queued(queue):
+    assert queue.enqueue("doi", ["10.1/a", "10.1/b"]) == 2
+    assert queue.enqueue("doi", ["10.1/b", "10.1/c"]) == 1
+    assert queue.counts() == {"pending": 3, "leased": 0, "done": 0, "failed": 0}
+
+
+def test_claim_leases_items_of_one_kind_up_to_claim_size(queue):
+    queue.enqueue("scholar", ["s{}".format(i) for i in range(CLAIM_SIZES["scholar"] + 5)])
+    queue.enqueue("doi", ["10.1/a"])
+
+    items = queue.claim("w1")
+    assert len(items) == CLAIM_SIZES["scholar"]
+    assert {kind for _, kind, _ in items} == {"scholar"}
+    assert queue.counts()["leased"] == CLAIM_SIZES["scholar"]
+
+    # The items leased by w1 are not handed to another worker
+    others = queue.claim("w2")
+    assert {payload for _, _, payload in others}.isdisjoint({payload for _, _, payload in items})
+    assert len(others) == 5
+
+
+def test_complete_stores_result_once_and_only_for_lease_holder(queue):
+    queue.enqueue("doi", ["10.1/a", "10.1/b"])
+    (a, _, _), (b, _, _) = queue.claim("w1")
+
+    assert not queue.complete(a, "w2", {"title": "wrong worker"})
+    assert queue.complete(a, "w1", {"title": "A"})
+    assert not queue.complete(a, "w1", {"title": "again"})
+    assert queue.complete(b, "w1", None)
+
+    assert queue.counts()["done"] == 2
+    assert list(queue.results()) == [{"title": "A"}]  # items done with nothing to report are left out
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    queue.enqueue("doi", ["10.1/a"])
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        (item, _, _), = queue.claim("w1")
+        queue.fail(item, "w1", "error {}".format(attempt))
+        expected = "failed" if attempt == MAX_ATTEMPTS else "pending"
+        assert queue.counts()[expected] == 1
+    assert queue.claim("w1") == []
+
+
+def test_expired_lease_is_claimed_again_by_another_worker(queue):
+    queue.enqueue("doi", ["10.1/a"])
+    (item, _, _), = queue.claim("w1", lease=0.5)
+    assert queue.claim("w2") == []
+
+    time.sleep(0.6)
+    (again, _, _), = queue.claim("w2")
+    assert again == item
+    # The worker that lost the lease can no longer report the item
+    assert not queue.complete(item, "w1", {"title": "late"})
+    assert queue.complete(item, "w2", {"title": "A"})
+
+
+def test_renew_keeps_the_lease(queue):
+    queue.enqueue("doi", ["10.1/a"])
+    queue.claim("w1", lease=0.5)
+    time.sleep(0.3)
+    queue.renew("w1", lease=10)
+    time.sleep(0.3)
+    assert queue.claim("w2") == []
+    assert queue.counts()["leased"] == 1
+
+
+def test_expired_items_are_given_up_after_max_attempts(queue):
+    queue.enqueue("doi", ["10.1/a"])
+    for _ in range(MAX_ATTEMPTS):
+        assert len(queue.claim("w1", lease=0.01)) == 1
+        time.sleep(0.02)
+    queue.expire()
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 0, "failed": 1}
+
+
+def test_drained_only_once_sealed(queue):
+    assert not queue.drained()  # the coordinator has not added the items yet
+    queue.enqueue("doi", ["10.1/a"])
+    queue.setSealed(True)
+    assert not queue.drained()
+
+    (item, _, _), = queue.claim("w1")
+    queue.complete(item, "w1", None)
+    assert queue.drained()
+
+    queue.setSealed(False)
+    assert not queue.drained()
+
+
+def test_queue_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / "work.sqlite")
+    coordinator, worker = WorkQueue(path), WorkQueue(path)
+    try:
+        coordinator.enqueue("doi", ["10.1/a"])
+        coordinator.setSealed(True)
+        (item, _, payload), = worker.claim("w1")
+        assert payload == "10.1/a"
+        worker.complete(item, "w1", {"DOI": payload})
+        assert coordinator.drained()
+        assert list(coordinator.results()) == [{"DOI": "10.1/a"}]
+    finally:
+        coordinator.close()
+        worker.close()
+
+
+def test_payload_and_result_round_trip_json(queue, monkeypatch):
+    monkeypatch.setitem(WorkQueueModule.CLAIM_SIZES, "scholar", 1)
+    payload = json.dumps({"url": "https://scholar/?q=x", "result": {"title": "T"}}, sort_keys=True)
+    queue.enqueue("scholar", [payload])
+    (item, kind, claimed), = queue.claim("w1")
+    assert (kind, json.loads(claimed)) == ("scholar", {"url": "https://scholar/?q=x", "result": {"title": "T"}})
@@ -0,0 +1,32 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+pytest.importorskip("requests")
+
+from PyPaperBot import Workers  # noqa: E402
+from PyPaperBot.WorkQueue import WorkQueue  # noqa: E402
+
+
+def test_worker_waits_for_the_queue_to_be_sealed(tmp_path, monkeypatch):
+    monkeypatch.setattr(Workers, "POLL_SECONDS", 0.05)
+    path = str(tmp_path / "work.sqlite")
+    processed = []
+
+    # Started before the coordinator has added anything
+    worker = threading.Thread(target=lambda: processed.append(Workers.runWorker(path, str(tmp_path))))
+    worker.start()
+    time.sleep(0.3)
+    assert worker.is_alive()
+
+    coordinator = WorkQueue(path)
+    coordinator.setSealed(True)
+    worker.join(5)
+    coordinator.close()
+    assert not worker.is_alive()
+    assert processed == [0]